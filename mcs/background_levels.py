@@ -1,14 +1,55 @@
+import numpy as np
 import pandas as pd
 from functools import lru_cache
+from sklearn.neighbors import BallTree
 
-from mcs.constants import GGD_STATION_TYPES
+from mcs import cache
+from mcs.constants import (
+    GGD_DATA_DIR,
+    GGD_YEARS,
+    GGD_COMPONENTS,
+    GGD_STATION_TYPES,
+    BACKGROUND_CACHE_DIR,
+    BACKGROUND_CACHE_MAX_BYTES,
+)
 from mcs.data_loaders import GGDDataLoader
 
+DEFAULT_STATION_TYPE2WEIGHT = {
+    "achtergrond": 1.0,
+    "industrie": 0.0,
+    "verkeer": 0.3,
+}
+# the weights of the background levels which are subtracted from the
+# measurements by default: all station types count equally
+UNIFORM_STATION_TYPE2WEIGHT = {
+    station_type: 1.0 for station_type in GGD_STATION_TYPES
+}
+
+EARTH_RADIUS_KM = 6371.0
+
+# bump this whenever the loading or weighting changes, to invalidate the
+# existing cache
+CACHE_VERSION = 1
+
+
+def get_station_type2weight(station_type2weight=None):
+    """fill in the default weight of 1.0 for the missing station types,
+    without modifying the given dictionary. if station_type2weight is None,
+    DEFAULT_STATION_TYPE2WEIGHT is used."""
+    if station_type2weight is None:
+        station_type2weight = DEFAULT_STATION_TYPE2WEIGHT
+    return {
+        station_type: station_type2weight.get(station_type, 1.0)
+        for station_type in sorted(
+            set(GGD_STATION_TYPES) | set(station_type2weight)
+        )
+    }
+
 
 def compute_weighted_mean_background_level(
     ggd_df,
     ggd_station_metadata_df,
-    station_type2weight={"achtergrond": 1.0, "industrie": 0.0, "verkeer": 0.3},
+    station_type2weight=None,
 ):
     """
     given background level measurements from multiple GGD stations in ggd_df,
@@ -16,12 +57,10 @@ def compute_weighted_mean_background_level(
 
     :param station_type2weight: optionally, pass a dictionary to give different
         weights to different station types in the mean (if a station_type is
-        missing, it will be given a default weight of 1.0).
+        missing, it will be given a default weight of 1.0). by default,
+        DEFAULT_STATION_TYPE2WEIGHT is used.
     """
-    # set default weights
-    for station_type in GGD_STATION_TYPES:
-        if station_type not in station_type2weight:
-            station_type2weight[station_type] = 1.0
+    station_type2weight = get_station_type2weight(station_type2weight)
 
     # get the weight per station code
     station_code2weight = ggd_station_metadata_df.loc[
@@ -35,56 +74,297 @@ def compute_weighted_mean_background_level(
     return weighted_mean
 
 
+def _get_ggd_fpaths():
+    # all the files which are read to get the data and the station metadata
+    fpaths = [
+        GGD_DATA_DIR / year / f"{year}_{component}.csv"
+        for year in GGD_YEARS
+        for component in GGD_COMPONENTS
+    ]
+    return [fpath for fpath in fpaths if fpath.exists()]
+
+
+def _get_cache_fpath(name, **params):
+    """the cache file for the given params. the source file fingerprints are
+    part of the key, so changed GGD files never hit an outdated entry."""
+    manifest = cache.build_manifest(
+        _get_ggd_fpaths(), version=CACHE_VERSION, **params
+    )
+    return (
+        BACKGROUND_CACHE_DIR
+        / f"{name}_{cache.hash_manifest(manifest)}.parquet"
+    )
+
+
+def _read_or_compute(cache_fpath, compute):
+    if cache_fpath.exists():
+        cache.touch(cache_fpath)
+        return pd.read_parquet(cache_fpath, engine="pyarrow")
+
+    df = compute()
+    cache.write_parquet(cache_fpath, df)
+    cache.enforce_size_bound(
+        BACKGROUND_CACHE_DIR,
+        BACKGROUND_CACHE_MAX_BYTES,
+        keep_fpaths=[cache_fpath],
+    )
+    return df
+
+
+def clear_background_cache():
+    """remove all the cached GGD data and background levels."""
+    load_ggd_data.cache_clear()
+    _load_weighted_mean_background_level.cache_clear()
+    cache.clear(BACKGROUND_CACHE_DIR)
+
+
 @lru_cache
 def load_ggd_data(component):
+    """load the GGD station measurements and the station metadata. besides
+    in memory, these are cached on disk, so only the first process after a
+    change to the GGD files reads all the csvs."""
     ggd_data_loader = GGDDataLoader()
-    ggd_df = ggd_data_loader.load_all(component)
-    ggd_station_metadata_df = ggd_data_loader.load_all_station_metadata()
+    ggd_df = _read_or_compute(
+        _get_cache_fpath("ggd", component=component),
+        lambda: ggd_data_loader.load_all(component),
+    )
+    ggd_station_metadata_df = _read_or_compute(
+        _get_cache_fpath("ggd_station_metadata"),
+        ggd_data_loader.load_all_station_metadata,
+    )
     return ggd_df, ggd_station_metadata_df
 
 
-def subtract_background_level_with_ggd_data(
-    series_or_df, component, station_type2weight={}
+@lru_cache
+def _load_weighted_mean_background_level(component, station_type2weight_items):
+    station_type2weight = dict(station_type2weight_items)
+
+    def _compute():
+        ggd_df, ggd_station_metadata_df = load_ggd_data(component)
+        weighted_mean = compute_weighted_mean_background_level(
+            ggd_df, ggd_station_metadata_df, station_type2weight
+        )
+        return weighted_mean.to_frame("weighted_mean")
+
+    df = _read_or_compute(
+        _get_cache_fpath(
+            "weighted_mean",
+            component=component,
+            station_type2weight=station_type2weight,
+        ),
+        _compute,
+    )
+    return df["weighted_mean"].rename(None)
+
+
+def load_weighted_mean_background_level(
+    component, station_type2weight=UNIFORM_STATION_TYPE2WEIGHT
 ):
+    """the weighted mean background level of the given component over the
+    entire GGD period, which is cached on disk per component and weights,
+    and in memory, so repeated calls (e.g. per chunk) are cheap.
+
+    :param station_type2weight: see compute_weighted_mean_background_level.
+        by default, all station types get a weight of 1.0.
     """
-    subtract the background levels of the given component from a series or df which
-    maps timestamps to the levels.
+    # the resolved weights are the cache key, so the same weights always
+    # hit the same entry, however they were passed
+    station_type2weight = get_station_type2weight(station_type2weight)
+    return _load_weighted_mean_background_level(
+        component, tuple(station_type2weight.items())
+    ).copy()
+
+
+def get_background_level(
+    index, component, station_type2weight=UNIFORM_STATION_TYPE2WEIGHT
+):
+    """
+    get the weighted mean background level of the given component at each
+    timestamp in index. each timestamp gets the level of the hour it's in,
+    which is found with a binary search on the hourly levels, so no
+    intermediate series with a row per second is needed.
 
     :param station_type2weight: optionally, pass a dictionary to give different
         weights to different station types in the mean (if a station_type is
-        missing, it will be given a default weight of 1.0).
+        missing, it will be given a default weight of 1.0). by default, all
+        station types get a weight of 1.0. if None,
+        DEFAULT_STATION_TYPE2WEIGHT is used.
     """
-    # load the ggd data
-    ggd_df, ggd_station_metadata_df = load_ggd_data(component)
+    weighted_mean = load_weighted_mean_background_level(
+        component, station_type2weight
+    )
 
-    # only take the period present in series. we include one hour of padding
-    # just to make sure we won't be missing any data later on
+    # only take the period present in the index. we include one hour of
+    # padding just to make sure we won't be missing any data later on
     date_range = slice(
-        (series_or_df.index.min().floor("h") - pd.DateOffset(hours=1)),
-        (series_or_df.index.max().ceil("h") + pd.DateOffset(hours=1)),
+        (index.min().floor("h") - pd.DateOffset(hours=1)),
+        (index.max().ceil("h") + pd.DateOffset(hours=1)),
     )
-    ggd_df = ggd_df.loc[date_range]
+    weighted_mean = weighted_mean.loc[date_range]
 
-    weighted_mean = compute_weighted_mean_background_level(
+    # take the level of the last hour at or before each timestamp, like a
+    # forward fill
+    return weighted_mean.reindex(index, method="ffill")
+
+
+class SpatialBackgroundLevelEstimator(object):
+    """
+    estimates the background level at any location and time, as a mean of
+    the levels measured by the GGD stations, weighted by the inverse of the
+    distance to each station (times the weight of its station type).
+
+    the stations are put in a ball tree once, after which any number of
+    points can be estimated at once, e.g. all the measurements of a mobile
+    city scanner.
+    """
+
+    def __init__(
+        self,
         ggd_df,
         ggd_station_metadata_df,
-        station_type2weight=station_type2weight,
-    )
-    # make sure we have a matching weighted mean timestamp for each row in the
-    # series
-    rel_weighted_mean = weighted_mean.resample("s").ffill()[series_or_df.index]
+        station_type2weight=None,
+        power=2.0,
+        n_neighbors=None,
+        min_distance_km=0.1,
+    ):
+        """
+        :param station_type2weight: see compute_weighted_mean_background_level.
+        :param power: the weight of a station is 1 / distance ** power, so a
+            higher power gives more weight to the nearby stations.
+        :param n_neighbors: optionally, only use this many nearest stations
+            per point. by default, all stations are used.
+        :param min_distance_km: distances are clipped to this minimum, so a
+            point right next to a station doesn't get an infinite weight.
+        """
+        station_type2weight = get_station_type2weight(station_type2weight)
+
+        # only the stations with both measurements and coordinates are used
+        metadata_df = ggd_station_metadata_df.loc[
+            ggd_station_metadata_df.index.isin(ggd_df.columns)
+        ].dropna(subset=["lat", "lng"])
+        if metadata_df.empty:
+            raise ValueError("none of the GGD stations have coordinates")
+
+        self._station_codes = list(metadata_df.index)
+        self._station_weights = (
+            metadata_df["Stationstype"]
+            .map(station_type2weight)
+            .fillna(1.0)
+            .to_numpy(dtype="float64")
+        )
+        self._hours = ggd_df.index.values
+        self._levels = ggd_df[self._station_codes].to_numpy(dtype="float64")
+        # the haversine metric expects [lat, lng] in radians
+        self._tree = BallTree(
+            np.radians(metadata_df[["lat", "lng"]].to_numpy(dtype="float64")),
+            metric="haversine",
+        )
 
-    def _subtract(series):
-        return series - rel_weighted_mean
+        self._power = power
+        self._min_distance_km = min_distance_km
+        self._n_neighbors = len(self._station_codes)
+        if n_neighbors is not None:
+            self._n_neighbors = min(n_neighbors, self._n_neighbors)
 
-    if isinstance(series_or_df, pd.Series):
-        result = _subtract(series_or_df)
+    def estimate(self, timestamps, latitudes, longitudes):
+        """
+        estimate the background level at each (timestamp, latitude,
+        longitude). like get_background_level, each timestamp gets the levels
+        of the hour it's in. returns an array with a level per point, which
+        is nan if the location is unknown or no station has a measurement.
+        """
+        points = np.radians(
+            np.column_stack([latitudes, longitudes]).astype("float64")
+        )
+        is_located = np.isfinite(points).all(axis=1)
+        levels = np.full(len(points), np.nan)
+        if not is_located.any():
+            return levels
+
+        # the nearest stations per point, with shape (n_points, n_neighbors)
+        distances, station_indices = self._tree.query(
+            points[is_located], k=self._n_neighbors
+        )
+        distances_km = np.maximum(
+            distances * EARTH_RADIUS_KM, self._min_distance_km
+        )
+        weights = (
+            self._station_weights[station_indices] / distances_km**self._power
+        )
+
+        # the hour of each point, and the station levels in that hour
+        hour_indices = (
+            np.searchsorted(
+                self._hours,
+                np.asarray(timestamps, dtype="datetime64[ns]")[is_located],
+                side="right",
+            )
+            - 1
+        )
+        station_levels = self._levels[
+            np.maximum(hour_indices, 0)[:, None], station_indices
+        ]
+        station_levels[hour_indices < 0] = np.nan
+
+        # the weighted mean over the stations with a measurement
+        is_measured = ~np.isnan(station_levels)
+        weights = np.where(is_measured, weights, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            levels[is_located] = (
+                np.where(is_measured, station_levels, 0.0) * weights
+            ).sum(axis=1) / weights.sum(axis=1)
+        return levels
+
+
+def get_spatial_background_level(
+    df, component, lat_col="latitude", lng_col="longitude", **kwargs
+):
+    """
+    get the background level of the given component for each row in df,
+    based on its timestamp and location (see
+    SpatialBackgroundLevelEstimator, to which kwargs are passed). df should
+    either have a timestamp index or a (sensor_name, timestamp) index, like
+    the MIT data.
+    """
+    ggd_df, ggd_station_metadata_df = load_ggd_data(component)
+    estimator = SpatialBackgroundLevelEstimator(
+        ggd_df, ggd_station_metadata_df, **kwargs
+    )
+
+    if isinstance(df.index, pd.MultiIndex):
+        timestamps = df.index.get_level_values("timestamp")
     else:
-        result = series_or_df.apply(_subtract, axis=0)
+        timestamps = df.index
+    levels = estimator.estimate(
+        timestamps, df[lat_col].to_numpy(), df[lng_col].to_numpy()
+    )
+    return pd.Series(levels, index=df.index)
+
+
+def subtract_background_level_with_ggd_data(
+    series_or_df, component, station_type2weight=UNIFORM_STATION_TYPE2WEIGHT
+):
+    """
+    subtract the background levels of the given component from a series or df which
+    maps timestamps to the levels.
+
+    :param station_type2weight: optionally, pass a dictionary to give different
+        weights to different station types in the mean (if a station_type is
+        missing, it will be given a default weight of 1.0). by default, all
+        station types get a weight of 1.0, see get_background_level.
+    """
+    rel_weighted_mean = get_background_level(
+        series_or_df.index, component, station_type2weight=station_type2weight
+    )
+    # subtract from all columns at once
+    result = series_or_df.sub(rel_weighted_mean, axis=0)
     return result, rel_weighted_mean
 
 
 def set_cols_without_bg(df, col2component):
+    # the background level only depends on the component, so it's computed
+    # once per component instead of once per column
+    component2bg = {}
     for col, component in col2component.items():
         if col in df:
 
@@ -95,15 +375,18 @@ def set_cols_without_bg(df, col2component):
                     [[target_name], df[col].columns]
                 )
                 if isinstance(result, pd.Series):
-                    for target_col in target_name:
-                        df[target_col] = result
-                else:
-                    df[target_name] = result
-
-            (
-                result,
-                rel_weighted_mean,
-            ) = subtract_background_level_with_ggd_data(df[col], component)
+                    # broadcast to all columns at once
+                    result = np.repeat(
+                        result.to_numpy()[:, None], len(target_name), axis=1
+                    )
+                df[target_name] = result
+
+            if component not in component2bg:
+                component2bg[component] = get_background_level(
+                    df.index, component
+                )
+            rel_weighted_mean = component2bg[component]
+            result = df[col].sub(rel_weighted_mean, axis=0)
             _set_cols(f"{col}_nobg", result)
             _set_cols(f"{col}_bg", rel_weighted_mean)
     return df
@@ -0,0 +1,92 @@
+import os
+import json
+import hashlib
+
+
+def get_fpath_fingerprint(fpath):
+    """get a fingerprint of a source file, which changes whenever the file is
+    modified (or replaced)."""
+    stat = os.stat(fpath)
+    return {
+        "fpath": str(fpath),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+    }
+
+
+def build_manifest(fpaths, **params):
+    """build a manifest of the given source files. any extra params which
+    influence the cached result (e.g. filter settings) should be passed as
+    keyword arguments, so a change in these also invalidates the cache."""
+    return {
+        "params": params,
+        "files": [get_fpath_fingerprint(fpath) for fpath in sorted(fpaths)],
+    }
+
+
+def hash_manifest(manifest):
+    serialized = json.dumps(manifest, sort_keys=True, default=str)
+    return hashlib.sha1(serialized.encode("utf-8")).hexdigest()
+
+
+def read_manifest(fpath):
+    if not fpath.exists():
+        return None
+    with open(fpath) as f:
+        return json.loads(f.read())
+
+
+def write_manifest(fpath, manifest):
+    fpath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_fpath = fpath.with_name(fpath.name + ".tmp")
+    with open(tmp_fpath, "w") as f:
+        f.write(json.dumps(manifest, sort_keys=True, default=str))
+    os.replace(tmp_fpath, fpath)
+
+
+def write_parquet(fpath, df, row_group_size=None):
+    """write a dataframe to parquet atomically, so a crash halfway doesn't
+    leave a corrupt cache file behind.
+
+    :param row_group_size: the number of rows per row group. for data sorted
+        on time, smaller row groups let reads with a time filter skip more of
+        the file.
+    """
+    fpath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_fpath = fpath.with_name(fpath.name + ".tmp")
+    df.to_parquet(tmp_fpath, engine="pyarrow", row_group_size=row_group_size)
+    os.replace(tmp_fpath, fpath)
+
+
+def touch(fpath):
+    """mark a cache file as recently used."""
+    os.utime(fpath)
+
+
+def enforce_size_bound(cache_dir, max_bytes, keep_fpaths=()):
+    """remove the least recently used files in cache_dir until their total
+    size is at most max_bytes. the files in keep_fpaths are never removed."""
+    if not cache_dir.exists():
+        return
+
+    keep_fpaths = set(map(str, keep_fpaths))
+    fpaths = [fpath for fpath in cache_dir.glob("**/*") if fpath.is_file()]
+    fpath2stat = {fpath: os.stat(fpath) for fpath in fpaths}
+    total_size = sum(stat.st_size for stat in fpath2stat.values())
+
+    for fpath in sorted(fpaths, key=lambda fpath: fpath2stat[fpath].st_mtime):
+        if total_size <= max_bytes:
+            break
+        if str(fpath) in keep_fpaths:
+            continue
+        os.remove(fpath)
+        total_size -= fpath2stat[fpath].st_size
+
+
+def clear(cache_dir):
+    """remove all files in cache_dir, e.g. to force a rebuild."""
+    if not cache_dir.exists():
+        return
+    for fpath in cache_dir.glob("**/*"):
+        if fpath.is_file():
+            os.remove(fpath)
@@ -1,11 +1,69 @@
+import pandas as pd
+
+
+def apply_sensor_corrections(mit_df, sensor_name2corrections):
+    """
+    correct the raw data of specific sensors, for all sensors at once.
+
+    :param sensor_name2corrections: per sensor, per column, the offset which
+        is added to it, and optionally the minimum it's clipped to, e.g.
+        {"ams1": {"PM25": {"offset": -8.18, "min": 0}}}.
+    """
+    mit_df = mit_df.copy()
+    sensor_names = mit_df.index.get_level_values(0)
+    cols = {
+        col
+        for col2correction in sensor_name2corrections.values()
+        for col in col2correction
+    }
+    for col in cols:
+        sensor_name2correction = {
+            sensor_name: col2correction[col]
+            for sensor_name, col2correction in sensor_name2corrections.items()
+            if col in col2correction
+        }
+        offsets = sensor_names.map(
+            {
+                sensor_name: correction["offset"]
+                for sensor_name, correction in sensor_name2correction.items()
+            }
+        ).fillna(0)
+        mins = sensor_names.map(
+            {
+                sensor_name: correction["min"]
+                for sensor_name, correction in sensor_name2correction.items()
+                if "min" in correction
+            }
+        )
+        # keep the dtype of the column
+        values = mit_df[col] + offsets.values.astype(mit_df[col].dtype)
+        mit_df[col] = values.where(~(values < mins.values), mins.values)
+    return mit_df
+
+
 class InputDataPreprocessor(object):
+    """
+    preprocesses the MIT data, and merges it with the KNMI data. the get_*_data
+    methods combine the data of all sensors (i.e. for calibration), while the
+    get_*_data_per_sensor methods keep the sensors apart, stacked in a single
+    frame, so all sensors can be calibrated in a single pass.
+    """
+
     def __init__(
         self,
         mit_df,
         knmi_df,
         start_datetime,
         end_datetime,
+        sensor_name2corrections=None,
     ):
+        """
+        :param sensor_name2corrections: corrections of the raw data of specific
+            sensors, see apply_sensor_corrections.
+        """
+        if sensor_name2corrections:
+            mit_df = apply_sensor_corrections(mit_df, sensor_name2corrections)
+
         # Add prefix to identify knmi from CS data
         self._mit_df = (
             mit_df.add_prefix("mit_")
@@ -44,6 +102,82 @@ class InputDataPreprocessor(object):
         )
         return mit_df[["mit_pm25", "mit_humidity"]]
 
+    def _get_pm25_mask(self, pm25_df, humidity_df):
+        """like _preprocess_pm25, but per sensor (i.e. column): which of the
+        pm25 values are kept."""
+        mask = pm25_df.notna() & humidity_df.notna()
+        pm25_df = pm25_df.where(mask)
+        return (
+            mask
+            # filter out extreme quantiles of pm25
+            & (pm25_df > pm25_df.quantile(0.05))
+            & (pm25_df < pm25_df.quantile(0.95))
+            # filter out high rel humidity
+            & (humidity_df < 90)
+        )
+
+    def _merge_knmi_data(self, mit_df, knmi_df):
+        """merge the knmi data into the stacked data of the sensors."""
+        knmi_df = knmi_df.reindex(
+            mit_df.index.get_level_values("timestamp")
+        ).set_axis(mit_df.index)
+        df = pd.concat([mit_df, knmi_df], axis=1)
+        if df.isna().any().any():
+            raise ValueError(
+                "there are nans in the merged df, which probably "
+                "is due to the knmi data not covering the same period as "
+                "the mit data."
+            )
+        return df
+
+    def _stack_sensors(self, col2df):
+        return (
+            pd.concat(col2df, axis=1)
+            .stack(level=1)
+            .swaplevel()
+            .sort_index()
+            .rename_axis(["sensor_name", "timestamp"])
+        )
+
+    def get_10sec_data_per_sensor(self):
+        mit_10sec_df = (
+            self._mit_df[["mit_PM25", "mit_humidity"]].resample("10s").mean()
+        )
+        mask = self._get_pm25_mask(
+            mit_10sec_df["mit_PM25"], mit_10sec_df["mit_humidity"]
+        )
+        mit_10sec_df = self._stack_sensors(
+            {
+                "mit_pm25": mit_10sec_df["mit_PM25"].where(mask),
+                "mit_humidity": mit_10sec_df["mit_humidity"].where(mask),
+            }
+        )
+        return self._merge_knmi_data(
+            mit_10sec_df, self._knmi_df.asfreq("10s").ffill()
+        )
+
+    def get_hourly_data_per_sensor(self):
+        mit_hourly_df = (
+            self._mit_df[["mit_PM25", "mit_gas_op2_w", "mit_humidity"]]
+            .resample("1h")
+            .mean()
+        )
+        mask = self._get_pm25_mask(
+            mit_hourly_df["mit_PM25"], mit_hourly_df["mit_humidity"]
+        )
+        mit_hourly_df = self._stack_sensors(
+            {
+                "mit_pm25": mit_hourly_df["mit_PM25"].where(mask),
+                "mit_no2_mv": mit_hourly_df["mit_gas_op2_w"],
+                "mit_humidity": mit_hourly_df["mit_humidity"],
+            }
+        )
+        # drop rows without measurements
+        mit_hourly_df = mit_hourly_df.dropna(how="any")
+        return self._merge_knmi_data(
+            mit_hourly_df, self._knmi_df.asfreq("1h").ffill()
+        )
+
     def get_10sec_data(self):
         mit_10sec_df = (
             self._mit_df[["mit_PM25", "mit_humidity"]].resample("10s").mean()
@@ -1,3 +1,5 @@
+import os
+import joblib
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -6,15 +8,25 @@ import statsmodels.api as sm
 import pylab
 import scipy.stats as stats
 
-from mcs import plot
+from mcs import plot, cache
+from mcs.constants import CALIBRATOR_CACHE_DIR
 from mcs.models import (
     get_linear_regression_model,
     get_polynomial_regression_model,
     get_random_forest_model,
 )
-from mcs.estimators import RegressionEstimator
+from mcs.estimators import (
+    RegressionEstimator,
+    train_estimators,
+    is_compilable,
+    get_X,
+)
 from mcs.log_encoder import LogEncoder
 
+# bump this whenever the training changes, so stored calibrators aren't used
+# anymore
+ARTIFACT_VERSION = 3
+
 
 def set_inf_and_zero_vals_to_nan(df, col):
     df.loc[
@@ -23,6 +35,14 @@ def set_inf_and_zero_vals_to_nan(df, col):
     ] = np.nan
 
 
+def get_predictor(estimator):
+    """the compiled estimator if its model can be compiled, as it predicts
+    much faster, otherwise the estimator itself."""
+    if is_compilable(estimator._model):
+        return estimator.compile()
+    return estimator
+
+
 def filter_dict_by_keys(dic, keys):
     return {key: value for key, value in dic.items() if key in keys}
 
@@ -41,13 +61,13 @@ def plot_predicted_vs_target_vals(
     # plt.figure(figsize=(4 * 1.5, 3 * 1.5))
     plt.figure(figsize=(12, 8))
     ax = plt.gca()
+    # the train set isn't encoded, so it doesn't need decoding
     df = estimator._df_train.sort_index()
-    df_decoded = estimator._encoder.decode_X(df)
     plot_df = pd.DataFrame(index=df.index)
-    plot_df["Actual (DCMR)"] = estimator._encoder.decode_y(df[y_col])
+    plot_df["Actual (DCMR)"] = df[y_col]
     if display_predicted:
-        plot_df["Predicted"] = estimator.predict(df_decoded)
-    plot_df["Raw (MIT)"] = df_decoded[source_x_col]
+        plot_df["Predicted"] = estimator.predict(df)
+    plot_df["Raw (MIT)"] = df[source_x_col]
     # plot_df = plot_df.rolling(window=80).mean().asfreq("10s")
     plot_df.plot(ax=ax, alpha=0.8, **plot_kwargs)
     component_pretty = plot.AxPrettifier.label2pretty_label.get(
@@ -71,6 +91,19 @@ def plot_predicted_vs_target_vals(
     plt.clf()
 
 
+def get_artifact_fpath(fpaths, **params):
+    """
+    the path to store a calibrator at, which is trained on the data in fpaths.
+    the path changes whenever these files change, so a stored calibrator is
+    only used if it was trained on the same data.
+
+    :param params: the params of the training data (e.g. its time range), and
+        the hyperparameters of the calibrator (see get_params).
+    """
+    manifest = cache.build_manifest(fpaths, version=ARTIFACT_VERSION, **params)
+    return CALIBRATOR_CACHE_DIR / f"{cache.hash_manifest(manifest)}.joblib"
+
+
 class MITDCMRCalibrator(object):
     # initialize calibration class
     def __init__(
@@ -88,20 +121,51 @@ class MITDCMRCalibrator(object):
                 # "random_forest",
             ],
         },
+        n_jobs=-1,
+        random_state=5,
     ):
+        """
+        :param n_jobs: the number of processes the models are trained in, -1
+            for all cores.
+        :param random_state: the seed of the models which are random (i.e. the
+            random forest), so the training is deterministic.
+        """
         self._plot_results = plot_results
         self._component2model_choices = component2model_choices
+        self._n_jobs = n_jobs
+        self._random_state = random_state
         self._has_trained = False
         self._plot_saver = plot.PlotSaver("calibration")
 
-    def _get_trained_model(
+    def _get_estimators(
         self,
         df,
         x_cols,
         y_col,
         name2model__estimator_options,
         general_estimator_options={},
+        **kwargs,
+    ):
+        name2estimator = {}
+        for name, (model, extra_opts) in name2model__estimator_options.items():
+            name2estimator[name] = RegressionEstimator(
+                model=model,
+                df=df,
+                x_cols=x_cols,
+                y_col=y_col,
+                **general_estimator_options,
+                **extra_opts,
+            )
+        return name2estimator
+
+    def _get_best_estimator(
+        self,
+        name2estimator,
+        df,
+        x_cols,
+        y_col,
         source_x_col=None,
+        **kwargs,
     ):
         results_df = None
         best_estimator = None
@@ -115,16 +179,7 @@ class MITDCMRCalibrator(object):
                 plt.xlabel(source_x_col)
                 plt.ylabel(y_col)
 
-        for name, (model, extra_opts) in name2model__estimator_options.items():
-            estimator = RegressionEstimator(
-                model=model,
-                df=df,
-                x_cols=x_cols,
-                y_col=y_col,
-                **general_estimator_options,
-                **extra_opts,
-            )
-            estimator.train()
+        for name, estimator in name2estimator.items():
             print(f"validation performance for {name}")
             r2, rmse, estimator_results_df = estimator.test()
             print()
@@ -146,19 +201,6 @@ class MITDCMRCalibrator(object):
                 results_df[source_x_col] = best_estimator._df_test[
                     source_x_col
                 ]
-                if best_estimator._encoder and (
-                    source_x_col
-                    in getattr(
-                        best_estimator._encoder,
-                        "_x_cols_to_encode",
-                        [],
-                    )
-                ):
-                    results_df[
-                        source_x_col
-                    ] = best_estimator._encoder.decode_y(
-                        results_df[source_x_col]
-                    )
 
             # Plot estimated values aganist target variable for RF and PM25
             results_df.plot(alpha=0.5)
@@ -182,7 +224,15 @@ class MITDCMRCalibrator(object):
             # Generate residuals plot for Polynomial model(PM25)
             # and RF for NO2
             residuals = y_test - y_pred
-            data = pd.DataFrame(best_estimator._df_test.copy())
+            # against the encoded features, which the model was fit on
+            df_test = best_estimator._df_test
+            data = pd.DataFrame(
+                best_estimator._encoder.transform(
+                    get_X(df_test, x_cols), copy=False
+                ),
+                columns=x_cols,
+                index=df_test.index,
+            )
             data["residuals"] = residuals
             sns.pairplot(data=data, y_vars=["residuals"], x_vars=x_cols)
             self._plot_saver.savefig(
@@ -196,7 +246,7 @@ class MITDCMRCalibrator(object):
 
         return best_estimator
 
-    def _get_trained_pm25_model(self, df):
+    def _get_pm25_estimator_kwargs(self, df):
         # define columns
         x_cols = [
             "mit_pm25",
@@ -220,8 +270,8 @@ class MITDCMRCalibrator(object):
         # target variable
         y_col = "dcmr_PM25"
         log_encoder = LogEncoder(x_cols_to_encode=["mit_pm25"])
-        best_estimator = self._get_trained_model(
-            df,
+        return dict(
+            df=df,
             x_cols=x_cols,
             source_x_col=x_cols[0],
             y_col=y_col,
@@ -239,16 +289,17 @@ class MITDCMRCalibrator(object):
                         {},
                     ),
                     "random_forest": (
-                        get_random_forest_model(),
+                        get_random_forest_model(
+                            random_state=self._random_state
+                        ),
                         {"do_cross_validation": False},
                     ),
                 },
                 self._component2model_choices["pm25"],
             ),
         )
-        return best_estimator
 
-    def _train_calibrated_no2_model(self, hourly_df):
+    def _get_no2_estimator_kwargs(self, hourly_df):
         # define columns
         x_cols = [
             "mit_no2_mv",
@@ -274,8 +325,8 @@ class MITDCMRCalibrator(object):
         # we take the log of the target variable, but no x cols because we can
         # just take the raw mv
         log_encoder = LogEncoder(x_cols_to_encode=[])
-        self._calibrated_no2_estimator = self._get_trained_model(
-            hourly_df,
+        return dict(
+            df=hourly_df,
             x_cols=x_cols,
             source_x_col=x_cols[0],
             y_col=y_col,
@@ -293,7 +344,9 @@ class MITDCMRCalibrator(object):
                         {},
                     ),
                     "random_forest": (
-                        get_random_forest_model(),
+                        get_random_forest_model(
+                            random_state=self._random_state
+                        ),
                         {"do_cross_validation": False},
                     ),
                 },
@@ -301,34 +354,23 @@ class MITDCMRCalibrator(object):
             ),
         )
 
-        plot_predicted_vs_target_vals(
-            self._calibrated_no2_estimator,
-            "mit_no2_mv",
-            "dcmr_no2",
-            "no2",
-            # ylim=(3.4, 65),
-            display_predicted=False,
-            plot_kwargs={"secondary_y": "Raw (MIT)"},
-            title="Raw vs actual NO2",
-            secondary_y_label="Raw NO2 signal (mV)",
-        )
-
-    def _train_calibrated_pm25_model_10sec(self, tensec_df):
-        self._calibrated_pm25_estimator_10sec = self._get_trained_pm25_model(
-            tensec_df
-        )
-        plot_predicted_vs_target_vals(
-            self._calibrated_pm25_estimator_10sec,
-            "mit_pm25",
-            "dcmr_PM25",
-            "pm25",
-            ylim=(3.4, 65),
-        )
-
-    def _train_calibrated_pm25_model_hourly(self, hourly_df):
-        self._calibrated_pm25_estimator_hourly = self._get_trained_pm25_model(
-            hourly_df
+    def _get_trained_estimators(self, target2estimator_kwargs):
+        """get the candidate estimators of all targets, trained. all their
+        models (and cross validation folds) are trained at once, in
+        parallel."""
+        target2name2estimator = {
+            target: self._get_estimators(**estimator_kwargs)
+            for target, estimator_kwargs in target2estimator_kwargs.items()
+        }
+        train_estimators(
+            [
+                estimator
+                for name2estimator in target2name2estimator.values()
+                for estimator in name2estimator.values()
+            ],
+            n_jobs=self._n_jobs,
         )
+        return target2name2estimator
 
     def train(
         self, train_10sec_df, train_hourly_df, dcmr_10sec_df, dcmr_hourly_df
@@ -346,19 +388,135 @@ class MITDCMRCalibrator(object):
             left_index=True,
             right_index=True,
         )
-        self._train_calibrated_pm25_model_10sec(tensec_df)
-        self._train_calibrated_pm25_model_hourly(hourly_df)
-        self._train_calibrated_no2_model(hourly_df)
+        target2estimator_kwargs = {
+            "pm25_10sec": self._get_pm25_estimator_kwargs(tensec_df),
+            "pm25_hourly": self._get_pm25_estimator_kwargs(hourly_df),
+            "no2_hourly": self._get_no2_estimator_kwargs(hourly_df),
+        }
+        target2name2estimator = self._get_trained_estimators(
+            target2estimator_kwargs
+        )
+
+        self._calibrated_pm25_estimator_10sec = self._get_best_estimator(
+            target2name2estimator["pm25_10sec"],
+            **target2estimator_kwargs["pm25_10sec"],
+        )
+        plot_predicted_vs_target_vals(
+            self._calibrated_pm25_estimator_10sec,
+            "mit_pm25",
+            "dcmr_PM25",
+            "pm25",
+            ylim=(3.4, 65),
+        )
+
+        self._calibrated_pm25_estimator_hourly = self._get_best_estimator(
+            target2name2estimator["pm25_hourly"],
+            **target2estimator_kwargs["pm25_hourly"],
+        )
+
+        self._calibrated_no2_estimator = self._get_best_estimator(
+            target2name2estimator["no2_hourly"],
+            **target2estimator_kwargs["no2_hourly"],
+        )
+        plot_predicted_vs_target_vals(
+            self._calibrated_no2_estimator,
+            "mit_no2_mv",
+            "dcmr_no2",
+            "no2",
+            # ylim=(3.4, 65),
+            display_predicted=False,
+            plot_kwargs={"secondary_y": "Raw (MIT)"},
+            title="Raw vs actual NO2",
+            secondary_y_label="Raw NO2 signal (mV)",
+        )
+        self._set_predictors()
         self._has_trained = True
 
+    def _set_predictors(self):
+        """get the predictors of the selected estimators once, so the
+        estimators aren't compiled again whenever we calibrate."""
+        self._pm25_predictor_10sec = get_predictor(
+            self._calibrated_pm25_estimator_10sec
+        )
+        self._pm25_predictor_hourly = get_predictor(
+            self._calibrated_pm25_estimator_hourly
+        )
+        self._no2_predictor = get_predictor(self._calibrated_no2_estimator)
+
+    def get_params(self):
+        """the hyperparameters which influence the trained models."""
+        return {
+            "component2model_choices": self._component2model_choices,
+            "random_state": self._random_state,
+        }
+
+    def save(self, fpath):
+        """store the trained estimators (with their scalers, encoders and
+        features), so calibrating doesn't need training anymore."""
+        if not self._has_trained:
+            raise RuntimeError("you need to call .train() first")
+
+        target2estimator = {
+            "pm25_10sec": self._calibrated_pm25_estimator_10sec,
+            "pm25_hourly": self._calibrated_pm25_estimator_hourly,
+            "no2_hourly": self._calibrated_no2_estimator,
+        }
+        artifact = {
+            "version": ARTIFACT_VERSION,
+            "params": self.get_params(),
+            "target2estimator": {
+                target: estimator.get_artifact()
+                for target, estimator in target2estimator.items()
+            },
+        }
+        fpath.parent.mkdir(exist_ok=True, parents=True)
+        tmp_fpath = fpath.with_name(fpath.name + ".tmp")
+        joblib.dump(artifact, tmp_fpath)
+        os.replace(tmp_fpath, fpath)
+
+    @classmethod
+    def load(cls, fpath, **kwargs):
+        """load a calibrator which was stored with save. it can calibrate
+        right away."""
+        artifact = joblib.load(fpath)
+        if artifact["version"] != ARTIFACT_VERSION:
+            raise ValueError(
+                f"the calibrator in {fpath} has version "
+                f"{artifact['version']}, but {ARTIFACT_VERSION} is needed"
+            )
+
+        target2estimator = {
+            target: RegressionEstimator.from_artifact(estimator_artifact)
+            for target, estimator_artifact in artifact[
+                "target2estimator"
+            ].items()
+        }
+        calibrator = cls(**artifact["params"], **kwargs)
+        calibrator._calibrated_pm25_estimator_10sec = target2estimator[
+            "pm25_10sec"
+        ]
+        calibrator._calibrated_pm25_estimator_hourly = target2estimator[
+            "pm25_hourly"
+        ]
+        calibrator._calibrated_no2_estimator = target2estimator["no2_hourly"]
+        calibrator._set_predictors()
+        calibrator._has_trained = True
+        return calibrator
+
     def calibrate(self, experiment_10sec_df, experiment_hourly_df):
+        """
+        calibrate the data in a single pass. the frames may contain the data
+        of several sensors stacked, e.g. from
+        InputDataPreprocessor.get_10sec_data_per_sensor, as all rows are
+        calibrated independently.
+        """
         if not self._has_trained:
             raise RuntimeError("you need to call .train() first")
 
         # 10sec
         experiment_10sec_df[
             "pm25_calibrated"
-        ] = self._calibrated_pm25_estimator_10sec.predict(experiment_10sec_df)
+        ] = self._pm25_predictor_10sec.predict(experiment_10sec_df)
         set_inf_and_zero_vals_to_nan(experiment_10sec_df, "pm25_calibrated")
 
         # models = self._calibrated_pm25_estimator_10sec._results["estimator"]
@@ -383,14 +541,12 @@ class MITDCMRCalibrator(object):
         # hourly
         experiment_hourly_df[
             "pm25_calibrated"
-        ] = self._calibrated_pm25_estimator_hourly.predict(
-            experiment_hourly_df
-        )
+        ] = self._pm25_predictor_hourly.predict(experiment_hourly_df)
         set_inf_and_zero_vals_to_nan(experiment_hourly_df, "pm25_calibrated")
 
         experiment_hourly_df[
             "no2_calibrated"
-        ] = self._calibrated_no2_estimator.predict(experiment_hourly_df)
+        ] = self._no2_predictor.predict(experiment_hourly_df)
         set_inf_and_zero_vals_to_nan(experiment_hourly_df, "no2_calibrated")
 
         return experiment_10sec_df, experiment_hourly_df
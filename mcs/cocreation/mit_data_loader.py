@@ -1,5 +1,6 @@
 import pandas as pd
 
+from mcs import utils
 from mcs.data_loaders import MITDataLoader
 from mcs.constants import (
     START_TIME,
@@ -28,6 +29,27 @@ RELEVANT_COLUMNS = [
     "no2_mgm3",
 ]
 
+# the columns which are loaded, to compute the RELEVANT_COLUMNS
+MIT_COLUMNS = [
+    "deviceID",
+    "latitude",
+    "longitude",
+    "PM1",
+    "PM25",
+    "temperature",
+    "humidity",
+    "humidity_opc",
+    "gas_op1_w",
+    "gas_op1_r",
+    "gas_op2_w",
+    "gas_op2_r",
+    "src_fpath",
+    "time_of_day",
+    "day_of_week",
+    "date",
+    "is_weekday",
+]
+
 ROLLING_WINDOW_SIZE = 30
 
 
@@ -95,13 +117,19 @@ class CocreationMITDataLoader(object):
 
         # loading the data for each sensor
         mit_cs_id2df = {
-            cs_id: data_loader.load_data(self._experiment_name, cs_id).loc[
-                self._measurement_range, :
-            ]
+            cs_id: data_loader.load_data(
+                self._experiment_name,
+                cs_id,
+                columns=MIT_COLUMNS,
+                start=self._measurement_range.start,
+                end=self._measurement_range.stop,
+            )
             for cs_id in self._cs_ids
         }
         # combine them into a single dataframe
-        df = pd.concat(mit_cs_id2df, names=["sensor_name", "timestamp"])
+        df = utils.concat_keeping_categoricals(
+            mit_cs_id2df, names=["sensor_name", "timestamp"]
+        )
 
         # correct the humidity
         df = self._set_humidity_corrected(df)
@@ -128,4 +156,7 @@ class CocreationMITDataLoader(object):
         # only take data between start and end time
         df_day = df.between_time(self._start_time, self._end_time)
 
-        return df.stack().swaplevel(), df_day.stack().swaplevel()
+        return (
+            utils.stack_keeping_categoricals(df).swaplevel(),
+            utils.stack_keeping_categoricals(df_day).swaplevel(),
+        )
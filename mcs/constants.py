@@ -9,13 +9,28 @@ ASSETS_DIR = ROOT_DIR / "mcs" / "assets"
 
 DATA_DIR = ROOT_DIR / "data"
 GGD_DATA_DIR = DATA_DIR / "ggd"
+# the compacted GGD data, see GGDDataLoader.compact
+GGD_STORE_DIR = GGD_DATA_DIR / "store"
+# what was fetched of the GGD and luchtmeetnet data, see sync_ggd_data.py
+GGD_SYNC_MANIFEST_FPATH = GGD_DATA_DIR / "sync_manifest.json"
 MIT_DATA_DIR = DATA_DIR / "mit"
 GVB_DATA_DIR = DATA_DIR / "gvb"
 KNMI_DATA_DIR = DATA_DIR / "knmi"
+# the converted KNMI data, see KNMIDataLoader.compact
+KNMI_STORE_DIR = KNMI_DATA_DIR / "store"
 UFP_DATA_DIR = DATA_DIR / "ufp"
 SNIFFER_DATA_DIR = DATA_DIR / "sniffer"
 DCMR_DATA_DIR = DATA_DIR / "dcmr"
 CALIBRATED_DATA_DIR = DATA_DIR / "calibrated"
+CACHE_DIR = DATA_DIR / "cache"
+MIT_CACHE_DIR = CACHE_DIR / "mit"
+BACKGROUND_CACHE_DIR = CACHE_DIR / "background"
+# the background cache is pruned to this size, removing the least recently
+# used files first
+BACKGROUND_CACHE_MAX_BYTES = 1024**3
+LUCHTMEETNET_CACHE_DIR = CACHE_DIR / "luchtmeetnet"
+# the trained calibrators, see MITDCMRCalibrator.save
+CALIBRATOR_CACHE_DIR = CACHE_DIR / "calibrator"
 
 CAMERA_DIR = DATA_DIR / "camera"
 CAMERA_IMAGES_DIR = CAMERA_DIR / "images"
@@ -188,6 +203,24 @@ MIT_NUMERIC_COLUMNS = [
     "noise",
 ]
 
+# the dtypes to parse the MIT CSVs with. float32 is precise enough for the
+# sensor readings, but the coordinates and unix timestamps need float64
+MIT_CSV_DTYPES = {
+    "is_summary": "float32",
+    "deviceID": "str",
+    "timestamp": "float64",
+    **{
+        col: "float64" if col in ["latitude", "longitude"] else "float32"
+        for col in MIT_NUMERIC_COLUMNS
+    },
+}
+
+# corrections of the raw MIT data of specific sensors in the experiment, per
+# column: the offset which is added to it, and the minimum it's clipped to
+MIT_SENSOR_NAME2CORRECTIONS = {
+    "ams1": {"PM25": {"offset": -8.18, "min": 0}},
+}
+
 BINSIZES = [
     0.35,
     0.46,
@@ -1,43 +1,159 @@
+import os
+import shutil
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
+from mcs import utils
 from mcs.constants import CALIBRATED_DATA_DIR
 from mcs.background_levels import set_cols_without_bg
 
+# the calibrated columns for which we compute the levels without background,
+# with the component of their background
+COL2COMPONENT = {
+    "pm25_calibrated": "PM25",
+    "no2_calibrated": "NO2",
+    "pm25_uncalibrated": "PM25",
+    "no2_uncalibrated": "NO2",
+}
+
+# the columns the data is partitioned on in the store
+PARTITION_COLUMNS = ["sensor_name", "day"]
+
 
 class CalibratedDataLoader(object):
+    """
+    the calibrated data is stored as a parquet dataset, partitioned by sensor
+    and day, so the dtypes are preserved and loading doesn't need any
+    parsing. data which was written as csv by earlier versions can still be
+    loaded.
+    """
+
     def __init__(self, experiment_name):
         self._experiment_name = experiment_name
         self._dir = CALIBRATED_DATA_DIR / self._experiment_name
 
-    def write_data(self, name, data):
-        fpath = self._dir / f"{name}.csv"
-        fpath.parent.mkdir(exist_ok=True, parents=True)
+    def _get_dataset_dir(self, name):
+        return self._dir / name
+
+    def _get_csv_fpath(self, name):
+        return self._dir / f"{name}.csv"
+
+    def _set_cols_without_bg(self, df):
+        col2component = {
+            col: component
+            for col, component in COL2COMPONENT.items()
+            if col in df and f"{col}_nobg" not in df
+        }
+        if not col2component:
+            return df
+
+        df = df.unstack(level=0)
+        set_cols_without_bg(df, col2component)
+        return utils.stack_keeping_categoricals(df).swaplevel()
+
+    def _write_dataset(self, df, dataset_dir):
+        """write (or append) the data to the dataset in dataset_dir."""
+        df = df.reset_index()
+        # partition by day, with the day formatted once per unique day
+        day_codes, days = pd.factorize(df["timestamp"].dt.normalize())
+        df["day"] = pd.Categorical.from_codes(
+            day_codes, categories=days.strftime("%Y-%m-%d")
+        )
+        pq.write_to_dataset(
+            pa.Table.from_pandas(df, preserve_index=False),
+            dataset_dir,
+            partition_cols=PARTITION_COLUMNS,
+        )
+
+    def _get_tmp_dir(self, dataset_dir):
+        # we write to a temporary directory first, so a crash halfway doesn't
+        # leave a partial dataset behind
+        tmp_dir = dataset_dir.with_name(dataset_dir.name + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return tmp_dir
+
+    def _replace_dataset(self, tmp_dir, dataset_dir):
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+        os.replace(tmp_dir, dataset_dir)
+
+    def write_data(self, name, data, with_bg=False):
+        """
+        :param with_bg: also compute the columns without background (and the
+            background levels themselves) and store them, so they don't have
+            to be computed again on every load. for large datasets, use
+            write_cols_without_bg after writing instead, which needs much less
+            memory.
+        """
         data.index.names = ["sensor_name", "timestamp"]
-        data.reset_index().to_csv(fpath, index=False)
+        if with_bg:
+            data = self._set_cols_without_bg(data)
+
+        dataset_dir = self._get_dataset_dir(name)
+        tmp_dir = self._get_tmp_dir(dataset_dir)
+        self._write_dataset(data, tmp_dir)
+        self._replace_dataset(tmp_dir, dataset_dir)
+
+    def write_cols_without_bg(self, name, freq="D"):
+        """
+        compute the columns without background for the stored data, and store
+        them with it. the data is processed one time window at a time, so
+        only a single window (of all sensors) is in memory at once, and the
+        results are written per window.
+
+        :param freq: the size of the time windows, e.g. "D" or "W". windows
+            consist of whole days, as the data is partitioned by day.
+        """
+        dataset_dir = self._get_dataset_dir(name)
+        if not dataset_dir.exists():
+            raise ValueError(f"this data doesn't exist: {dataset_dir}")
+
+        days = sorted(
+            {
+                fpath.name.split("=", 1)[1]
+                for fpath in dataset_dir.glob("sensor_name=*/day=*")
+            }
+        )
+        window2days = pd.Series(days).groupby(
+            pd.to_datetime(days).to_period(freq)
+        )
+
+        tmp_dir = self._get_tmp_dir(dataset_dir)
+        for window, window_days in window2days:
+            print(
+                f"[CalibratedDataLoader] subtracting background for {window}"
+            )
+            df = self._read_dataset(
+                dataset_dir, filters=[("day", "in", list(window_days))]
+            )
+            self._write_dataset(self._set_cols_without_bg(df), tmp_dir)
+        self._replace_dataset(tmp_dir, dataset_dir)
+
+    def _read_dataset(self, dataset_dir, filters=None):
+        df = pq.read_table(
+            dataset_dir, memory_map=True, filters=filters
+        ).to_pandas()
+        df = df.drop(columns="day")
+        # partition columns come back as categoricals
+        df["sensor_name"] = df["sensor_name"].astype(str)
+        return df.set_index(["sensor_name", "timestamp"]).sort_index()
 
     def load_data(self, name):
-        fpath = self._dir / f"{name}.csv"
-        if not fpath.exists():
+        dataset_dir = self._get_dataset_dir(name)
+        csv_fpath = self._get_csv_fpath(name)
+        if dataset_dir.exists():
+            df = self._read_dataset(dataset_dir)
+        elif csv_fpath.exists():
+            df = pd.read_csv(
+                csv_fpath,
+                index_col=["sensor_name", "timestamp"],
+                parse_dates=["timestamp"],
+            )
+        else:
             raise ValueError(
-                f"this file doesn't exist: {fpath}. "
+                f"this data doesn't exist: {dataset_dir}. "
                 "did you maybe forgot to run scripts/write_calibrated_data.py?"
             )
 
-        df = pd.read_csv(
-            fpath,
-            index_col=["sensor_name", "timestamp"],
-            parse_dates=["timestamp"],
-        )
-        df = df.unstack(level=0)
-        set_cols_without_bg(
-            df,
-            {
-                "pm25_calibrated": "PM25",
-                "no2_calibrated": "NO2",
-                "pm25_uncalibrated": "PM25",
-                "no2_uncalibrated": "NO2",
-            },
-        )
-        df = df.stack().swaplevel()
-
-        return df
+        # only computes the columns without background which weren't stored
+        return self._set_cols_without_bg(df)
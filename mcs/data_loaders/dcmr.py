@@ -4,6 +4,10 @@ from mcs.constants import DCMR_DATA_DIR
 
 
 class DCMRDataLoader(object):
+    def get_fpaths(self, experiment_name):
+        """the excel files with the data of the experiment."""
+        return list((DCMR_DATA_DIR / experiment_name).glob("*.xlsx"))
+
     def _load_pm25_10sec(self, experiment_dir):
         df = pd.read_excel(
             experiment_dir / "pm25-10sec.xlsx",
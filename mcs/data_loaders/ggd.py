@@ -1,14 +1,21 @@
+import io
+import json
 import pandas as pd
-import numpy as np
 import itertools
+import pyarrow.parquet as pq
 
 from mcs.constants import (
     GGD_DATA_DIR,
+    GGD_STORE_DIR,
     GGD_YEARS,
     GGD_COMPONENTS,
     GGD_AMSTERDAM_STATION_NAMES,
     GGD_AMSTERDAM_STATION_CODES,
 )
+from mcs import utils, cache
+
+# bump this whenever the compaction changes, to invalidate existing stores
+STORE_VERSION = 1
 
 
 def get_station_codes_from_columns(columns):
@@ -21,26 +28,28 @@ def get_station_codes_from_columns(columns):
 
 class GGDDataLoader(object):
     def __init__(self):
-        pass
+        # the station metadata of the files which were already read, so
+        # loading the metadata after the data doesn't read the files again
+        self._fpath2station_metadata = {}
 
     def _get_skiprows(self, fpath):
         fname = fpath.name
         return {"2020_NH3.csv": 8, "2021_NH3.csv": 6}.get(fname, 0)
 
-    def _load_station_metadata(self, fpath):
-        print(f"[GGDDataLoader] reading metadata from {fpath}")
-
-        try:
-            df = pd.read_csv(
-                fpath,
-                sep=";",
-                encoding="latin-1",
-                nrows=6,
-                index_col=False,
-                skiprows=self._get_skiprows(fpath),
-            )
-        except FileNotFoundError:
-            return None
+    def _get_nof_header_lines(self, fpath):
+        # the metadata header consists of a line with the column names and
+        # six lines with info per station. the tabular data starts after it,
+        # on the eighth row (headers)
+        return self._get_skiprows(fpath) + 7
+
+    def _parse_station_metadata(self, fpath, header_lines):
+        df = pd.read_csv(
+            io.StringIO("".join(header_lines)),
+            sep=";",
+            nrows=6,
+            index_col=False,
+            skiprows=self._get_skiprows(fpath),
+        )
         # station data starts on fifth column
         df = df.iloc[:, 4:]
 
@@ -49,29 +58,56 @@ class GGDDataLoader(object):
 
         station_code2info = df.set_index("StationsCode").T
 
-        def _get_lat_lng(val):
-            if pd.isna(val):
-                return [np.nan, np.nan]
-            return [float(v) for v in val.strip("(").strip(")").split(",")]
-
-        station_code2info[["lat", "lng"]] = (
+        # e.g. "(52.38,4.85)"; anything else (like a missing value) becomes
+        # nan
+        lat_lng_df = (
             station_code2info["Latitude,Longitude"]
-            .map(_get_lat_lng)
-            .values.tolist()
+            .astype(str)
+            .str.strip("()")
+            .str.extract(r"^([^,]*),([^,]*)$")
+            .astype(float)
         )
+        station_code2info["lat"] = lat_lng_df[0].values
+        station_code2info["lng"] = lat_lng_df[1].values
 
         return station_code2info
 
+    def _load_station_metadata(self, fpath):
+        if str(fpath) in self._fpath2station_metadata:
+            station_metadata = self._fpath2station_metadata[str(fpath)]
+            return (
+                None if station_metadata is None else station_metadata.copy()
+            )
+
+        print(f"[GGDDataLoader] reading metadata from {fpath}")
+
+        try:
+            with open(fpath, encoding="latin-1") as f:
+                # only the header is read
+                header_lines = list(
+                    itertools.islice(f, self._get_nof_header_lines(fpath))
+                )
+        except FileNotFoundError:
+            return None
+
+        station_metadata = self._parse_station_metadata(fpath, header_lines)
+        self._fpath2station_metadata[str(fpath)] = station_metadata
+        return station_metadata
+
     def _load_data(self, fpath):
         print(f"[GGDDataLoader] reading {fpath}")
 
-        # tabular data starts on eighth row (headers)
-        skiprows = 7 + self._get_skiprows(fpath)
-
         try:
-            df = pd.read_csv(
-                fpath, sep=";", encoding="latin-1", skiprows=skiprows
-            )
+            with open(fpath, encoding="latin-1") as f:
+                # the file is read once: first the metadata header, which we
+                # keep for when the metadata is loaded, then the tabular data
+                header_lines = list(
+                    itertools.islice(f, self._get_nof_header_lines(fpath))
+                )
+                self._fpath2station_metadata[str(fpath)] = (
+                    self._parse_station_metadata(fpath, header_lines)
+                )
+                df = pd.read_csv(f, sep=";")
         except FileNotFoundError:
             return None
 
@@ -104,8 +140,11 @@ class GGDDataLoader(object):
 
         return df
 
+    def _get_fpath(self, year, component):
+        return GGD_DATA_DIR / str(year) / f"{year}_{component}.csv"
+
     def load(self, year, component):
-        fpath = GGD_DATA_DIR / str(year) / f"{year}_{component}.csv"
+        fpath = self._get_fpath(year, component)
         df = self._load_data(fpath)
         if df is not None:
             df["year"] = year
@@ -113,7 +152,7 @@ class GGDDataLoader(object):
         return df
 
     def load_station_metadata(self, year, component):
-        fpath = GGD_DATA_DIR / str(year) / f"{year}_{component}.csv"
+        fpath = self._get_fpath(year, component)
         metadata_df = self._load_station_metadata(fpath)
         if metadata_df is not None:
             metadata_df["year"] = year
@@ -123,9 +162,186 @@ class GGDDataLoader(object):
     def _get_all_year_component_combinations(self):
         return itertools.product(GGD_YEARS, GGD_COMPONENTS)
 
-    def load_all(self, component, all_stations=False):
-        dfs = [self.load(year, component) for year in GGD_YEARS]
-        df = pd.concat([df for df in dfs if df is not None])
+    def _get_years_in_time_range(self, start, end):
+        # each file covers either a year (e.g. "2021") or a month ("2022_01")
+        years = []
+        for year in GGD_YEARS:
+            period = year.replace("_", "-")
+            if utils.ranges_overlap(
+                start, end, *utils.get_inclusive_time_bounds(period, period)
+            ):
+                years.append(year)
+        return years
+
+    def _get_store_manifest(self):
+        fpaths = [
+            self._get_fpath(year, component)
+            for year, component in self._get_all_year_component_combinations()
+        ]
+        return cache.build_manifest(
+            [fpath for fpath in fpaths if fpath.exists()],
+            version=STORE_VERSION,
+        )
+
+    def _get_store_manifest_fpath(self):
+        return GGD_STORE_DIR / "manifest.json"
+
+    def _get_store_data_fpath(self, component):
+        return GGD_STORE_DIR / f"{component}.parquet"
+
+    def _get_store_year2station_codes_fpath(self, component):
+        return GGD_STORE_DIR / f"{component}.stations.json"
+
+    def _get_store_metadata_fpath(self):
+        return GGD_STORE_DIR / "station_metadata.parquet"
+
+    def _get_store_file_fpath(self, year, component):
+        return GGD_STORE_DIR / "files" / f"{year}_{component}.parquet"
+
+    def _load_for_store(self, year, component, unchanged_fpaths):
+        """load the measurements of a single csv, reusing what was parsed
+        during the previous compaction if the csv didn't change since."""
+        fpath = self._get_fpath(year, component)
+        if not fpath.exists():
+            return None
+        store_file_fpath = self._get_store_file_fpath(year, component)
+        if str(fpath) in unchanged_fpaths and store_file_fpath.exists():
+            return pd.read_parquet(store_file_fpath, engine="pyarrow")
+
+        df = self.load(year, component)
+        if df is None:
+            return None
+        df = df[
+            ["Begindatumtijd"] + get_station_codes_from_columns(df.columns)
+        ]
+        cache.write_parquet(store_file_fpath, df)
+        return df
+
+    def has_up_to_date_store(self):
+        """whether the store exists and reflects the current csvs."""
+        manifest = cache.read_manifest(self._get_store_manifest_fpath())
+        return manifest is not None and manifest == self._get_store_manifest()
+
+    def compact(self):
+        """
+        compact all the GGD (and luchtmeetnet) csvs into a store with, per
+        component, a single parquet file with a row per hour and a column per
+        station, and a sidecar table with the station metadata. as long as
+        the csvs don't change, load_all and load_all_station_metadata read
+        from this store instead of parsing the csvs. recompacting only parses
+        the csvs which changed since the previous compaction.
+        """
+        manifest = self._get_store_manifest()
+
+        # only the csvs which changed since the previous compaction (e.g. the
+        # months which were just fetched) are parsed again
+        unchanged_fpaths = set()
+        previous_manifest = cache.read_manifest(
+            self._get_store_manifest_fpath()
+        )
+        if (
+            previous_manifest is not None
+            and previous_manifest["params"] == manifest["params"]
+        ):
+            unchanged_fpaths = {
+                fingerprint["fpath"]
+                for fingerprint in manifest["files"]
+                if fingerprint in previous_manifest["files"]
+            }
+
+        for component in GGD_COMPONENTS:
+            year2df = {}
+            for year in GGD_YEARS:
+                df = self._load_for_store(year, component, unchanged_fpaths)
+                if df is not None:
+                    year2df[year] = df
+            if not year2df:
+                continue
+
+            # keep track of the stations per file, so loading a time range
+            # gives the same stations as reading the csvs of that range
+            year2station_codes = {
+                year: get_station_codes_from_columns(df.columns)
+                for year, df in year2df.items()
+            }
+            df = self._preprocess_data(pd.concat(year2df.values()))
+
+            cache.write_parquet(self._get_store_data_fpath(component), df)
+            fpath = self._get_store_year2station_codes_fpath(component)
+            with open(fpath, "w") as f:
+                f.write(json.dumps(year2station_codes))
+
+        cache.write_parquet(
+            self._get_store_metadata_fpath(),
+            self._load_all_station_metadata_from_csvs(),
+        )
+
+        # write the manifest last, so it never refers to an outdated store
+        cache.write_manifest(self._get_store_manifest_fpath(), manifest)
+
+    def _load_all_from_store(self, component, years, all_stations, start, end):
+        print(f"[GGDDataLoader] reading {component} from the store")
+        data_fpath = self._get_store_data_fpath(component)
+        if not data_fpath.exists():
+            raise ValueError(f"there is no {component} data in the store")
+
+        fpath = self._get_store_year2station_codes_fpath(component)
+        with open(fpath) as f:
+            year2station_codes = json.loads(f.read())
+        if not any(year in year2station_codes for year in years):
+            raise ValueError(
+                f"there is no {component} data between {start} and {end}"
+            )
+        station_codes = set(
+            itertools.chain.from_iterable(
+                year2station_codes.get(year, []) for year in years
+            )
+        )
+        if not all_stations:
+            station_codes &= GGD_AMSTERDAM_STATION_CODES
+
+        # only the relevant stations and hours are read
+        columns = [
+            col
+            for col in pq.read_schema(data_fpath).names
+            if col in station_codes
+        ]
+        filters = []
+        if start is not None:
+            filters.append(("Begindatumtijd", ">=", start))
+        if end is not None:
+            filters.append(("Begindatumtijd", "<=", end))
+        df = pd.read_parquet(
+            data_fpath,
+            engine="pyarrow",
+            columns=columns,
+            filters=filters or None,
+        )
+        return df.asfreq("H")
+
+    def load_all(self, component, all_stations=False, start=None, end=None):
+        """
+        :param start, end: optionally, only load the data in this time range
+            (inclusive, like df.loc[start:end]). only the files covering the
+            range are read.
+
+        if the store is up to date (see compact), the data is read from the
+        store, and only the stations and hours which are needed are read.
+        """
+        start, end = utils.get_inclusive_time_bounds(start, end)
+        years = self._get_years_in_time_range(start, end)
+        if self.has_up_to_date_store():
+            return self._load_all_from_store(
+                component, years, all_stations, start, end
+            )
+
+        dfs = [self.load(year, component) for year in years]
+        dfs = [df for df in dfs if df is not None]
+        if not dfs:
+            raise ValueError(
+                f"there is no {component} data between {start} and {end}"
+            )
+        df = pd.concat(dfs)
 
         if not all_stations:
             # filter the columns on the relevant StationsCodes
@@ -141,16 +357,24 @@ class GGDDataLoader(object):
             columns += list(set(df.columns) & set(GGD_AMSTERDAM_STATION_CODES))
             df = df[columns]
 
-        return self._preprocess_data(df)
+        return self._preprocess_data(df).loc[start:end]
 
-    def load_all_station_metadata(
-        self, all_stations=False, keep_all_unique=False
-    ):
+    def _load_all_station_metadata_from_csvs(self):
         metadata_dfs = [
             self.load_station_metadata(year, component)
             for year, component in self._get_all_year_component_combinations()
         ]
-        metadata_df = pd.concat([df for df in metadata_dfs if df is not None])
+        return pd.concat([df for df in metadata_dfs if df is not None])
+
+    def load_all_station_metadata(
+        self, all_stations=False, keep_all_unique=False
+    ):
+        if self.has_up_to_date_store():
+            metadata_df = pd.read_parquet(
+                self._get_store_metadata_fpath(), engine="pyarrow"
+            )
+        else:
+            metadata_df = self._load_all_station_metadata_from_csvs()
 
         if not all_stations:
             metadata_df = metadata_df[
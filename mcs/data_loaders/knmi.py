@@ -1,10 +1,17 @@
 from mcs.constants import (
     KNMI_DATA_DIR,
+    KNMI_STORE_DIR,
     EXPERIMENT_START_DATE,
     EXPERIMENT_END_DATE,
 )
 import os
+import numpy as np
 import pandas as pd
+import pyarrow.feather as feather
+
+from mcs import utils, cache
+
+STORE_VERSION = 1
 
 colcode2colname = {
     "# STN": "station",
@@ -81,34 +88,137 @@ colcode2colname = {
 
 
 class KNMIDataLoader(object):
+    """
+    loads the hourly KNMI data of a station. the txt files can be converted
+    (see compact) into a store with a feather file per station, with typed
+    columns and the timestamps already parsed. as long as the txt file
+    doesn't change, the data is loaded from this store instead, by memory
+    mapping the file and only converting the requested time range.
+    """
+
+    def get_fpath(self, station_code):
+        return KNMI_DATA_DIR / f"uurgeg_{station_code}_2021-2030.txt"
+
+    def _get_store_fpath(self, station_code):
+        return KNMI_STORE_DIR / f"uurgeg_{station_code}.feather"
+
+    def _get_store_manifest_fpath(self, station_code):
+        return KNMI_STORE_DIR / f"uurgeg_{station_code}.manifest.json"
+
+    def _get_store_manifest(self, station_code):
+        return cache.build_manifest(
+            [self.get_fpath(station_code)], version=STORE_VERSION
+        )
+
+    def has_up_to_date_store(self, station_code="240"):
+        """whether the store of the station exists and reflects its txt."""
+        manifest = cache.read_manifest(
+            self._get_store_manifest_fpath(station_code)
+        )
+        return manifest is not None and manifest == self._get_store_manifest(
+            station_code
+        )
+
+    def _read_txt(self, station_code, usecols=None):
+        df = pd.read_csv(
+            self.get_fpath(station_code),
+            skiprows=30,
+            sep=",",
+            # missing values are written as spaces
+            skipinitialspace=True,
+            usecols=usecols,
+        )
+        df.columns = df.columns.str.strip().map(colcode2colname)
+
+        # the hours are 1-24, the hour in which the measurement ended, so
+        # hour 24 is midnight at the start of the next day
+        df["timestamp"] = pd.to_datetime(
+            df["date"], format="%Y%m%d"
+        ) + pd.to_timedelta(df["hour"], unit="h")
+
+        return df.set_index("timestamp").sort_index()
+
+    def compact(self, station_code="240"):
+        """convert the txt file of the station into its store."""
+        df = self._read_txt(station_code)
+
+        fpath = self._get_store_fpath(station_code)
+        fpath.parent.mkdir(exist_ok=True, parents=True)
+        tmp_fpath = fpath.with_name(fpath.name + ".tmp")
+        # uncompressed, so the file can be memory mapped
+        feather.write_feather(
+            df.reset_index(), tmp_fpath, compression="uncompressed"
+        )
+        os.replace(tmp_fpath, fpath)
+
+        # write the manifest last, so it never refers to an outdated store
+        cache.write_manifest(
+            self._get_store_manifest_fpath(station_code),
+            self._get_store_manifest(station_code),
+        )
+
+    def _load_data_from_store(self, station_code, start, end, columns):
+        table = feather.read_table(
+            self._get_store_fpath(station_code), memory_map=True
+        )
+        if columns is not None:
+            table = table.select(
+                [
+                    col
+                    for col in table.column_names
+                    if col == "timestamp" or col in columns
+                ]
+            )
+
+        # the store is sorted on time, so the time range is a slice of it
+        timestamps = table.column("timestamp").to_numpy()
+        start_idx, end_idx = 0, len(timestamps)
+        if start is not None:
+            start_idx = np.searchsorted(timestamps, start.to_datetime64())
+        if end is not None:
+            end_idx = np.searchsorted(
+                timestamps, end.to_datetime64(), side="right"
+            )
+
+        return (
+            table.slice(start_idx, max(end_idx - start_idx, 0))
+            .to_pandas()
+            .set_index("timestamp")
+        )
+
     def load_data(
         self,
         station_code="240",
         start_date=EXPERIMENT_START_DATE,
         end_date=EXPERIMENT_END_DATE,
+        columns=None,
     ):
-        fname = f"uurgeg_{station_code}_2021-2030.txt"
-        fpath = os.path.join(KNMI_DATA_DIR, fname)
-        df = pd.read_csv(fpath, skiprows=30, sep=",")
-        df.columns = df.columns.str.strip().map(colcode2colname)
+        """
+        :param columns: optionally, only read these columns (e.g.
+            ["temperature", "air_pressure"]).
+        """
+        usecols = None
+        if columns is not None:
+            unknown_columns = set(columns) - set(colcode2colname.values())
+            if unknown_columns:
+                raise ValueError(f"unknown columns: {sorted(unknown_columns)}")
 
-        # convert date and time information to DateTime column
-        df["timestamp"] = pd.to_datetime(
-            df["date"].astype(str)
-            + " "
-            + df["hour"].astype(str).str.zfill(2).replace("24", "00"),
-            format="%Y%m%d %H",
-        )
+            # the date and hour are always needed to create the timestamps
+            colnames_to_read = {"date", "hour", *columns}
 
-        # set timestamp as index
-        df = df.set_index("timestamp")
+            def usecols(colcode):
+                return colcode2colname.get(colcode.strip()) in colnames_to_read
 
         # only select data which was within experiment time period
-        if start_date:
-            df = df.loc[start_date:]
-        if end_date:
-            df = df.loc[:end_date]
+        start, end = utils.get_inclusive_time_bounds(
+            start_date or None, end_date or None
+        )
+        if self.has_up_to_date_store(station_code):
+            df = self._load_data_from_store(station_code, start, end, columns)
+        else:
+            df = self._read_txt(station_code, usecols=usecols).loc[start:end]
 
-        df = df.sort_index()
+        if columns is not None:
+            df = df[[col for col in df.columns if col in columns]]
 
         return df
@@ -1,12 +1,18 @@
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv as pyarrow_csv
 from datetime import datetime
+from pathlib import Path
+from functools import partial
 
 from mcs.constants import (
     MIT_DATA_DIR,
+    MIT_CACHE_DIR,
     MIT_CSV_HEADERS,
+    MIT_CSV_DTYPES,
     MIT_NUMERIC_COLUMNS,
 )
-from mcs import utils
+from mcs import utils, cache
 
 
 def print_rows_removal(mask, reason):
@@ -18,40 +24,151 @@ def print_rows_removal(mask, reason):
     )
 
 
+# the columns which are always read, because preprocessing depends on them
+PREPROCESSING_COLUMNS = [
+    "is_summary",
+    "deviceID",
+    "timestamp",
+    "latitude",
+    "longitude",
+    "data_is_valid",
+]
+PROVENANCE_COLUMNS = ["src_fpath", "src_fname"]
+
+# the timestamps are in UTC, and we're UTC+1
+UTC_OFFSET = pd.DateOffset(hours=1)
+
+# one day of 5s measurements per row group in the cache, so reads with a time
+# window can skip most of the cache file
+ROW_GROUP_SIZE = 17280
+
+# bump this whenever the preprocessing changes, to invalidate existing caches
+CACHE_VERSION = 3
+
+
+def drop_duplicate_timestamps(df):
+    """only keep the first row per timestamp. ties are broken on the device
+    and source file, so the same row is kept regardless of the order in which
+    the source files were ingested."""
+    tiebreak_columns = [
+        col for col in ["deviceID", "src_fpath"] if col in df.columns
+    ]
+    df = df.sort_values(["timestamp", *tiebreak_columns], kind="stable")
+    duplicate_indices = df.index.duplicated(keep="first")
+    df = df[~duplicate_indices]
+    print_rows_removal(duplicate_indices, "timestamp was duplicate")
+    return df
+
+
 class MITDataLoader(object):
-    def __init__(self):
-        pass
-
-    def _read_csv(self, fpath):
-        read_csv_kwargs = {
-            "header": None,
-            "names": MIT_CSV_HEADERS,
-            "index_col": False,
-            "na_values": ["na"],
-        }
+    def __init__(
+        self,
+        use_cache=True,
+        incremental=True,
+        n_workers=None,
+        csv_engine="pyarrow",
+    ):
+        """
+        :param use_cache: if True, the preprocessed data per sensor is cached
+            as parquet in MIT_CACHE_DIR. the cache is invalidated whenever a
+            source CSV is added, removed or modified.
+        :param incremental: if True (and use_cache is True), source CSVs which
+            were added since the cache was written are preprocessed and merged
+            into the cached data, instead of reprocessing all files. removed
+            or modified files still trigger a full reprocessing.
+        :param n_workers: number of processes used to load the data. when
+            loading multiple sensors, each sensor is loaded in its own
+            process; when loading a single sensor, its CSVs are parsed
+            concurrently. if None, everything is loaded in this process.
+        :param csv_engine: "pyarrow" or "c". the engine used to parse the
+            CSVs with MIT_CSV_DTYPES. files which can't be parsed with these
+            dtypes are parsed without them by pandas' c engine.
+        """
+        self._use_cache = use_cache
+        self._incremental = incremental
+        self._n_workers = n_workers
+        self._csv_engine = csv_engine
+        # the time range per source file, per sensor, see _get_file_index
+        self._sensor2file_index = {}
+
+    def _has_malformed_first_line(self, fpath):
+        # some files start with a malformed (e.g. half-written) line. we detect
+        # these by peeking at the first line, instead of parsing the whole
+        # file twice
+        with open(fpath, "rb") as f:
+            first_line = f.readline()
+        is_summary = first_line.split(b",")[0].strip()
+        return b'"' in first_line or not is_summary.isdigit()
+
+    def _read_typed_csv(self, fpath, skiprows, usecols):
+        if self._csv_engine == "pyarrow":
+            table = pyarrow_csv.read_csv(
+                fpath,
+                read_options=pyarrow_csv.ReadOptions(
+                    column_names=MIT_CSV_HEADERS, skip_rows=skiprows
+                ),
+                convert_options=pyarrow_csv.ConvertOptions(
+                    column_types={
+                        col: pa.string() if dtype == "str" else dtype
+                        for col, dtype in MIT_CSV_DTYPES.items()
+                    },
+                    null_values=["na", ""],
+                    include_columns=usecols,
+                ),
+            )
+            return table.to_pandas()
+
+        return pd.read_csv(
+            fpath,
+            header=None,
+            names=MIT_CSV_HEADERS,
+            index_col=False,
+            na_values=["na"],
+            dtype=MIT_CSV_DTYPES,
+            usecols=usecols,
+            skiprows=skiprows,
+        )
+
+    def _read_untyped_csv(self, fpath, skiprows, usecols):
+        df = pd.read_csv(
+            fpath,
+            header=None,
+            names=MIT_CSV_HEADERS,
+            index_col=False,
+            na_values=["na"],
+            usecols=usecols,
+            skiprows=skiprows,
+        )
+        for col in MIT_NUMERIC_COLUMNS + ["is_summary", "timestamp"]:
+            if col in df:
+                df[col] = pd.to_numeric(df[col], errors="coerce").astype(
+                    MIT_CSV_DTYPES[col]
+                )
+        return df
+
+    def _read_csv(self, fpath, usecols=None):
+        if usecols is not None:
+            usecols = [col for col in MIT_CSV_HEADERS if col in usecols]
+        skiprows = 1 if self._has_malformed_first_line(fpath) else 0
 
         try:
-            df = pd.read_csv(fpath, **read_csv_kwargs)
-        except pd.errors.ParserError:
-            df = pd.read_csv(fpath, **read_csv_kwargs, skiprows=1)
+            df = self._read_typed_csv(fpath, skiprows, usecols)
+        except (pa.ArrowInvalid, ValueError):
+            # the file contains ragged rows or non-numeric values in numeric
+            # columns, so we parse without dtypes and coerce afterwards
+            df = self._read_untyped_csv(fpath, skiprows, usecols)
 
-        df["src_fpath"] = str(fpath)
-        df["src_fname"] = fpath.name
+        df["src_fpath"] = utils.constant_categorical(str(fpath), len(df))
+        df["src_fname"] = utils.constant_categorical(fpath.name, len(df))
         return df
 
     def _preprocess_data(self, df):
         # filter out the summary rows
         df = df[df["is_summary"] == 0].copy()
 
+        # the numeric columns already have their dtypes from parsing
         df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
 
-        for numeric_col in ["PM1", "PM10", "PM25"]:
-            df[numeric_col] = pd.to_numeric(df[numeric_col], errors="coerce")
-
-        for col in df.columns:
-            if "bin" in col:
-                df[col] = df[col].astype("float")
-
         # some timestamps might be from 1999; we only want data from last year
         # and later
         this_year = datetime.now().year
@@ -62,7 +179,7 @@ class MITDataLoader(object):
         )
 
         # it's a UTC timestamp, and we're UTC+1
-        df["timestamp"] += pd.DateOffset(hours=1)
+        df["timestamp"] += UTC_OFFSET
 
         # round to the nearest 5 seconds
         df["timestamp"] = df["timestamp"].dt.round("5s")
@@ -73,15 +190,11 @@ class MITDataLoader(object):
             if col not in MIT_NUMERIC_COLUMNS and col != "timestamp"
         ]
         # then also make sure we're taking the mean of any measurements which
-        # are now rounded to the same timestamp by resampling. we do this with
-        # a pd.Grouper to prevent non-numeric columns to be lost in the
+        # are now rounded to the same timestamp by resampling. we group on the
+        # non-numeric columns as well to prevent them to be lost in the
         # resampling
-        df = (
-            df.groupby(
-                [pd.Grouper(freq="5s", key="timestamp"), *non_numeric_columns]
-            )
-            .mean()
-            .reset_index()
+        df = utils.average_per_time_bin(
+            df, non_numeric_columns, freq="5s", time_col="timestamp"
         )
 
         utils.set_timestamp_related_cols(df, src_col="timestamp")
@@ -108,35 +221,325 @@ class MITDataLoader(object):
         df = df[~data_is_invalid]
         print_rows_removal(data_is_invalid, "data_is_valid (OPC) was False")
 
-        duplicate_indices = df.index.duplicated(keep="first")
-        df = df[~duplicate_indices]
-        print_rows_removal(duplicate_indices, "timestamp was duplicate")
+        df = drop_duplicate_timestamps(df)
 
         return df
 
-    def load_data(self, experiment_name, sensor_name):
+    def _get_cache_fpaths(self, experiment_name, sensor_name):
+        cache_dir = MIT_CACHE_DIR / experiment_name
+        return (
+            cache_dir / f"{sensor_name}.parquet",
+            cache_dir / f"{sensor_name}.manifest.json",
+        )
+
+    def _get_manifest(self, fpaths):
+        # the preprocessing filters on the current year, so the cached result
+        # is only valid during the year it was created in
+        return cache.build_manifest(
+            fpaths, min_year=datetime.now().year, version=CACHE_VERSION
+        )
+
+    def _get_new_fpaths(self, cached_manifest, manifest):
+        """if the cached data can be brought up to date by only ingesting
+        added source files, return those. otherwise, return None."""
+        if cached_manifest is None:
+            return None
+        if cached_manifest["params"] != manifest["params"]:
+            return None
+
+        fpath2file = {file["fpath"]: file for file in manifest["files"]}
+        for cached_file in cached_manifest["files"]:
+            if fpath2file.get(cached_file["fpath"]) != cached_file:
+                return None
+
+        cached_fpaths = {file["fpath"] for file in cached_manifest["files"]}
+        return [
+            Path(file["fpath"])
+            for file in manifest["files"]
+            if file["fpath"] not in cached_fpaths
+        ]
+
+    def _merge_data(self, df, new_df):
+        # rows from different source files are never averaged together in
+        # the 5s grouping, so only the duplicate timestamps at the boundary
+        # between the existing and new data need to be resolved
+        df = utils.concat_keeping_categoricals([df, new_df])
+        return drop_duplicate_timestamps(df)
+
+    def _write_cached_data(self, experiment_name, sensor_name, manifest, df):
+        data_fpath, manifest_fpath = self._get_cache_fpaths(
+            experiment_name, sensor_name
+        )
+        cache.write_parquet(data_fpath, df, row_group_size=ROW_GROUP_SIZE)
+        # write the manifest last, so it never refers to an outdated data file
+        cache.write_manifest(manifest_fpath, manifest)
+
+    def _read_cached_data(self, data_fpath, columns=None, filters=None):
+        df = pd.read_parquet(
+            data_fpath,
+            engine="pyarrow",
+            memory_map=True,
+            columns=columns,
+            filters=filters,
+        )
+        # parquet can't store a dictionary of dates, so the date column comes
+        # back as objects
+        if "date" in df:
+            df["date"] = df["date"].astype("category")
+        return df
+
+    def _get_usecols(self, columns):
+        if columns is None:
+            return None
+
+        unknown_columns = (
+            set(columns)
+            - set(MIT_CSV_HEADERS)
+            - set(PROVENANCE_COLUMNS)
+            - set(utils.TIMESTAMP_RELATED_COLUMNS)
+        )
+        if unknown_columns:
+            raise ValueError(f"unknown columns: {sorted(unknown_columns)}")
+
+        return [
+            col
+            for col in MIT_CSV_HEADERS
+            if col in columns or col in PREPROCESSING_COLUMNS
+        ]
+
+    def _select_columns(self, df, columns):
+        if columns is None:
+            return df
+        return df[[col for col in df.columns if col in columns]]
+
+    def _get_time_range(self, df):
+        # get bounds of the timestamps of a parsed CSV as they'll be after
+        # preprocessing. these are conservative, as rows might still be
+        # filtered out, and timestamps are rounded to 5s
+        timestamps = pd.to_datetime(df["timestamp"], unit="s")
+        if timestamps.isna().all():
+            return None, None
+        return (
+            str(timestamps.min() + UTC_OFFSET - pd.Timedelta(seconds=5)),
+            str(timestamps.max() + UTC_OFFSET + pd.Timedelta(seconds=5)),
+        )
+
+    def _get_file_index_fpath(self, experiment_name, sensor_name):
+        return (
+            MIT_CACHE_DIR / experiment_name / f"{sensor_name}.file_index.json"
+        )
+
+    def _get_file_index(self, experiment_name, sensor_name):
+        """the time range per source file which is known: the ones which
+        were stored with the cache, and the ones this loader found itself."""
+        key = (experiment_name, sensor_name)
+        if key not in self._sensor2file_index:
+            index_fpath = self._get_file_index_fpath(
+                experiment_name, sensor_name
+            )
+            self._sensor2file_index[key] = (
+                cache.read_manifest(index_fpath) or {}
+            )
+        return self._sensor2file_index[key]
+
+    def _update_file_index(self, experiment_name, sensor_name, fpath2range):
+        """keep the time range per source file, so that later loads with a
+        time window can skip the files outside of it. it's only stored next
+        to the cache if we use the cache, so a loader without a cache never
+        writes to the cache directory."""
+        file_index = self._get_file_index(experiment_name, sensor_name)
+        for fpath, (min_timestamp, max_timestamp) in fpath2range.items():
+            file_index[str(fpath)] = {
+                **cache.get_fpath_fingerprint(fpath),
+                "min_timestamp": min_timestamp,
+                "max_timestamp": max_timestamp,
+            }
+        if self._use_cache:
+            cache.write_manifest(
+                self._get_file_index_fpath(experiment_name, sensor_name),
+                file_index,
+            )
+
+    def _select_fpaths_in_time_range(
+        self, experiment_name, sensor_name, fpaths, start, end
+    ):
+        if start is None and end is None:
+            return fpaths
+
+        file_index = self._get_file_index(experiment_name, sensor_name)
+
+        selected_fpaths = []
+        for fpath in fpaths:
+            fingerprint = cache.get_fpath_fingerprint(fpath)
+            entry = file_index.get(str(fpath))
+            if entry is None or any(
+                entry[key] != value for key, value in fingerprint.items()
+            ):
+                # we don't know the time range of this file (yet)
+                selected_fpaths.append(fpath)
+            elif entry["min_timestamp"] is None:
+                # the file doesn't contain any timestamps
+                continue
+            elif utils.ranges_overlap(
+                start,
+                end,
+                pd.Timestamp(entry["min_timestamp"]),
+                pd.Timestamp(entry["max_timestamp"]),
+            ):
+                selected_fpaths.append(fpath)
+
+        print(
+            f"[MITDataLoader] skipping {len(fpaths) - len(selected_fpaths)}"
+            f"/{len(fpaths)} files outside of the time range"
+        )
+        if not selected_fpaths:
+            # still read a single file, so the result has the right columns
+            selected_fpaths = fpaths[:1]
+        return selected_fpaths
+
+    def _load_data_from_fpaths(self, fpaths, columns=None):
+        """load and preprocess the given files. besides the data, this
+        returns the time range per file."""
+        dfs = utils.map_in_processes(
+            partial(self._read_csv, usecols=self._get_usecols(columns)),
+            fpaths,
+            self._n_workers,
+        )
+        fpath2range = {
+            fpath: self._get_time_range(df) for fpath, df in zip(fpaths, dfs)
+        }
+        df = utils.concat_keeping_categoricals(dfs)
+        df = self._preprocess_data(df)
+        return self._select_columns(df, columns), fpath2range
+
+    def _load_data_with_cache(
+        self,
+        experiment_name,
+        sensor_name,
+        fpaths,
+        columns=None,
+        start=None,
+        end=None,
+    ):
+        # the cache always contains all columns, and the projection is done
+        # when reading it
+        data_fpath, manifest_fpath = self._get_cache_fpaths(
+            experiment_name, sensor_name
+        )
+        manifest = self._get_manifest(fpaths)
+        cached_manifest = None
+        if data_fpath.exists():
+            cached_manifest = cache.read_manifest(manifest_fpath)
+
+        if cached_manifest == manifest:
+            print(
+                f"[MITDataLoader] reading cache for {experiment_name}/{sensor_name}"
+            )
+            # the cache is sorted on time, so the filters let pyarrow skip
+            # the row groups outside of the time range
+            filters = []
+            if start is not None:
+                filters.append(("timestamp", ">=", start))
+            if end is not None:
+                filters.append(("timestamp", "<=", end))
+            return self._read_cached_data(
+                data_fpath, columns=columns, filters=filters or None
+            )
+
+        new_fpaths = None
+        if self._incremental:
+            new_fpaths = self._get_new_fpaths(cached_manifest, manifest)
+
+        if new_fpaths is None:
+            df, fpath2range = self._load_data_from_fpaths(fpaths)
+        else:
+            print(
+                f"[MITDataLoader] ingesting {len(new_fpaths)} new files for "
+                f"{experiment_name}/{sensor_name}"
+            )
+            new_df, fpath2range = self._load_data_from_fpaths(new_fpaths)
+            df = self._merge_data(self._read_cached_data(data_fpath), new_df)
+
+        self._write_cached_data(experiment_name, sensor_name, manifest, df)
+        # so loaders without a cache can skip the files outside of a time
+        # range
+        self._update_file_index(experiment_name, sensor_name, fpath2range)
+        return self._select_columns(df, columns).loc[start:end]
+
+    def get_fpaths(self, experiment_name, sensor_name):
+        """the csvs with the data of the sensor."""
+        data_dir = MIT_DATA_DIR / experiment_name / sensor_name
+        return list(data_dir.glob("**/*.CSV"))
+
+    def load_data(
+        self, experiment_name, sensor_name, columns=None, start=None, end=None
+    ):
+        """
+        :param columns: optionally, only load these columns. without a cache,
+            only these columns (and the ones needed for preprocessing) are
+            parsed. with a cache, only these columns are read from it.
+        :param start, end: optionally, only load the data in this time range
+            (inclusive, like df.loc[start:end]). with a cache, only the row
+            groups in the range are read. without a cache, the files outside
+            of the range are skipped, based on the time range per file which
+            was stored when the cache was built, or which this loader found
+            when it parsed the file before.
+        """
         if isinstance(sensor_name, (list, tuple)):
             return self._load_data_for_multiple_sensors(
-                experiment_name, sensor_name
+                experiment_name, sensor_name, columns, start, end
             )
 
+        # validate the columns before doing any work
+        self._get_usecols(columns)
+
         print(f"[MITDataLoader] loading {experiment_name}/{sensor_name}")
         data_dir = MIT_DATA_DIR / experiment_name / sensor_name
         if not data_dir.exists():
             raise ValueError(
                 "the directory for the given experiment and device does not exist"
             )
-        dfs = [self._read_csv(fpath) for fpath in data_dir.glob("**/*.CSV")]
-        df = pd.concat(dfs)
-        df = self._preprocess_data(df)
-        return df
+        fpaths = self.get_fpaths(experiment_name, sensor_name)
+        start, end = utils.get_inclusive_time_bounds(start, end)
+
+        if self._use_cache:
+            return self._load_data_with_cache(
+                experiment_name, sensor_name, fpaths, columns, start, end
+            )
+
+        fpaths = self._select_fpaths_in_time_range(
+            experiment_name, sensor_name, fpaths, start, end
+        )
+        df, fpath2range = self._load_data_from_fpaths(fpaths, columns)
+        self._update_file_index(experiment_name, sensor_name, fpath2range)
+        return df.loc[start:end]
 
-    def _load_data_for_multiple_sensors(self, experiment_name, sensor_names):
-        df = pd.concat(
-            {
-                name: self.load_data(experiment_name, name)
-                for name in sensor_names
-            },
+    def _load_data_for_multiple_sensors(
+        self, experiment_name, sensor_names, columns=None, start=None, end=None
+    ):
+        # the sensors are spread over the workers, so each sensor itself is
+        # loaded in a single process
+        sensor_loader = MITDataLoader(
+            use_cache=self._use_cache,
+            incremental=self._incremental,
+            csv_engine=self._csv_engine,
+        )
+        # share the known time ranges of the files. in worker processes,
+        # the loader gets a copy of them
+        sensor_loader._sensor2file_index = self._sensor2file_index
+        dfs = utils.map_in_processes(
+            partial(
+                sensor_loader.load_data,
+                experiment_name,
+                columns=columns,
+                start=start,
+                end=end,
+            ),
+            sensor_names,
+            self._n_workers,
+        )
+        df = utils.concat_keeping_categoricals(
+            dict(zip(sensor_names, dfs)),
             names=["sensor_name", "timestamp"],
         )
         return df
@@ -23,18 +23,37 @@ PWMpump
 """
 
 from mcs.constants import UFP_DATA_DIR
+import os
 import pandas as pd
+from functools import partial
 
 from mcs import utils
 
 DEVICE_NAME2NOF_SECONDS_OFFSET = {"sensor1": 32, "sensor2": 0}
 
+# the columns which are not read from the files, but created while loading
+DERIVED_COLUMNS = [
+    "timestamp",
+    "src_fpath",
+    "src_fname",
+    *utils.TIMESTAMP_RELATED_COLUMNS,
+]
+
 
 class UFPDataLoader(object):
+    def __init__(self, n_workers=None):
+        """
+        :param n_workers: number of processes used to load the data. when
+            loading multiple sensors, each sensor is loaded in its own
+            process; when loading a single sensor, its files are parsed
+            concurrently. if None, everything is loaded in this process.
+        """
+        self._n_workers = n_workers
+
     def _extract_start_time(self, fpath):
         # open the file and find starting day and time
         with open(fpath, "r") as f:
-            for line in f.readlines():
+            for line in f:
                 if line.startswith("Start: "):
                     return pd.to_datetime(
                         line[7:].strip(), format="%d.%m.%Y %H:%M:%S"
@@ -42,14 +61,70 @@ class UFPDataLoader(object):
 
         return None
 
-    def _read_txt(self, fpath):
-        df = pd.read_csv(fpath, skiprows=18, sep="\t")
+    def _extract_end_time(self, fpath, start_time):
+        # the first column contains the number of seconds since the start, so
+        # we only have to read the last line to know when the file ends
+        with open(fpath, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            lines = f.read().splitlines()
+        try:
+            nof_seconds = float(lines[-1].split(b"\t")[0])
+        except (ValueError, IndexError):
+            return None
+        return start_time + pd.to_timedelta(nof_seconds - 1, unit="s")
+
+    def _get_time_range(self, fpath, device_name):
+        # conservative bounds of the timestamps in the file after
+        # preprocessing, which shifts and rounds them to 5s
+        start_time = self._extract_start_time(fpath)
+        if start_time is None:
+            return None, None
+        end_time = self._extract_end_time(fpath, start_time)
+        offset = pd.Timedelta(
+            seconds=DEVICE_NAME2NOF_SECONDS_OFFSET.get(device_name, 0)
+        )
+        margin = pd.Timedelta(seconds=5)
+        return (
+            start_time + offset - margin,
+            None if end_time is None else end_time + offset + margin,
+        )
+
+    def _select_fpaths_in_time_range(self, fpaths, device_name, start, end):
+        if start is None and end is None:
+            return fpaths
+
+        selected_fpaths = [
+            fpath
+            for fpath in fpaths
+            if utils.ranges_overlap(
+                start, end, *self._get_time_range(fpath, device_name)
+            )
+        ]
+        print(
+            f"[UFPDataLoader] skipping {len(fpaths) - len(selected_fpaths)}"
+            f"/{len(fpaths)} files outside of the time range"
+        )
+        if not selected_fpaths:
+            # still read a single file, so the result has the right columns
+            selected_fpaths = fpaths[:1]
+        return selected_fpaths
+
+    def _read_txt(self, fpath, usecols=None):
+        if usecols is not None:
+            # the time column is always needed to compute the timestamp
+            usecols = ["time"] + [
+                col
+                for col in usecols
+                if col not in DERIVED_COLUMNS and col != "time"
+            ]
+        df = pd.read_csv(fpath, skiprows=18, sep="\t", usecols=usecols)
         start_day_time = self._extract_start_time(fpath)
         timestamp = start_day_time + pd.to_timedelta(df["time"] - 1, unit="s")
         df["timestamp"] = timestamp
 
-        df["src_fpath"] = str(fpath)
-        df["src_fname"] = fpath.name
+        df["src_fpath"] = utils.constant_categorical(str(fpath), len(df))
+        df["src_fname"] = utils.constant_categorical(fpath.name, len(df))
 
         return df
 
@@ -74,15 +149,11 @@ class UFPDataLoader(object):
             and col != "timestamp"
         ]
         # then also make sure we're taking the mean of any measurements which
-        # are now rounded to the same timestamp by resampling. we do this with
-        # a pd.Grouper to prevent non-numeric columns to be lost in the
+        # are now rounded to the same timestamp by resampling. we group on the
+        # non-numeric columns as well to prevent them to be lost in the
         # resampling
-        df = (
-            df.groupby(
-                [pd.Grouper(freq="5s", key="timestamp"), *non_numeric_columns]
-            )
-            .mean()
-            .reset_index()
+        df = utils.average_per_time_bin(
+            df, non_numeric_columns, freq="5s", time_col="timestamp"
         )
 
         utils.set_timestamp_related_cols(df, src_col="timestamp")
@@ -90,24 +161,58 @@ class UFPDataLoader(object):
         df = df.set_index("timestamp")
         return df
 
-    def load_data(self, experiment_name, sensor_name):
+    def load_data(
+        self, experiment_name, sensor_name, columns=None, start=None, end=None
+    ):
+        """
+        :param columns: optionally, only read and preprocess these columns.
+        :param start, end: optionally, only load the data in this time range
+            (inclusive, like df.loc[start:end]). files outside of the range
+            are skipped based on their start time and last line.
+        """
         if isinstance(sensor_name, (list, tuple)):
             return self._load_data_for_multiple_sensors(
-                experiment_name, sensor_name
+                experiment_name, sensor_name, columns, start, end
             )
 
         # example path: data/ufp/2022_11_25/sensor1/...
         data_dir = UFP_DATA_DIR / experiment_name / sensor_name
-        dfs = [self._read_txt(fpath) for fpath in data_dir.glob("**/*.txt")]
-        df = pd.concat(dfs)
+        start, end = utils.get_inclusive_time_bounds(start, end)
+        fpaths = self._select_fpaths_in_time_range(
+            list(data_dir.glob("**/*.txt")), sensor_name, start, end
+        )
+        dfs = utils.map_in_processes(
+            partial(self._read_txt, usecols=columns),
+            fpaths,
+            self._n_workers,
+        )
+        df = utils.concat_keeping_categoricals(dfs)
         df = self._preprocess_data(df, sensor_name)
-        return df
 
-    def _load_data_for_multiple_sensors(self, experiment_name, sensor_names):
+        if columns is not None:
+            df = df[[col for col in df.columns if col in columns]]
+        return df.loc[start:end]
+
+    def _load_data_for_multiple_sensors(
+        self, experiment_name, sensor_names, columns=None, start=None, end=None
+    ):
+        # the sensors are spread over the workers, so each sensor itself is
+        # loaded in a single process
+        dfs = utils.map_in_processes(
+            partial(
+                UFPDataLoader().load_data,
+                experiment_name,
+                columns=columns,
+                start=start,
+                end=end,
+            ),
+            sensor_names,
+            self._n_workers,
+        )
         ufp_device_name2df = {
-            f"ufp_{sensor_name}": self.load_data(experiment_name, sensor_name)
-            for sensor_name in sensor_names
+            f"ufp_{sensor_name}": df
+            for sensor_name, df in zip(sensor_names, dfs)
         }
-        return pd.concat(
+        return utils.concat_keeping_categoricals(
             ufp_device_name2df, names=["sensor_name", "timestamp"]
         )
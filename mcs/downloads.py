@@ -0,0 +1,129 @@
+import os
+import time
+import zipfile
+import requests
+from collections import defaultdict
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# the maximum number of files which are downloaded at the same time
+N_WORKERS = 8
+# the size of the chunks in which responses are written to disk
+CHUNK_SIZE = 1024**2
+REQUEST_TIMEOUT_SECONDS = 60
+
+
+class Download(object):
+    """
+    a file to download. the response is streamed to fpath in chunks, so it's
+    never completely in memory. if unzip, the downloaded zip is extracted
+    into the directory of fpath and removed afterwards.
+    """
+
+    def __init__(self, source, url, fpath, unzip=False):
+        self.source = source
+        self.url = url
+        self.fpath = fpath
+        self.unzip = unzip
+        # set when downloading
+        self.headers = None
+        self.n_bytes = 0
+        self.error = None
+        self.start_time = None
+        self.end_time = None
+
+
+def get_url(url, mirror_url=None):
+    """the url to download from. if mirror_url is given, e.g. a local file
+    server for testing, the path of url is requested from there instead."""
+    if mirror_url is None:
+        return url
+    return mirror_url.rstrip("/") + urlparse(url).path
+
+
+def create_session(n_workers=N_WORKERS):
+    """a session with a connection pool which is shared by the workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=n_workers, pool_maxsize=n_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _download(session, download, mirror_url):
+    download.start_time = time.perf_counter()
+    url = get_url(download.url, mirror_url)
+    download.fpath.parent.mkdir(exist_ok=True, parents=True)
+    # we write to a temporary file first, so a failed download doesn't leave
+    # a partial file behind
+    tmp_fpath = download.fpath.with_name(download.fpath.name + ".tmp")
+    try:
+        with session.get(
+            url, stream=True, timeout=REQUEST_TIMEOUT_SECONDS
+        ) as response:
+            response.raise_for_status()
+            download.headers = response.headers
+            with open(tmp_fpath, "wb") as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    download.n_bytes += len(chunk)
+
+        if download.unzip:
+            with zipfile.ZipFile(tmp_fpath) as zip_file:
+                zip_file.extractall(download.fpath.parent)
+            os.remove(tmp_fpath)
+        else:
+            os.replace(tmp_fpath, download.fpath)
+    except (requests.RequestException, zipfile.BadZipFile) as e:
+        download.error = e
+        if tmp_fpath.exists():
+            os.remove(tmp_fpath)
+    download.end_time = time.perf_counter()
+    return download
+
+
+def _print_throughput(source, downloads):
+    # the sources are downloaded concurrently, so this is the time from the
+    # first download of the source starting to the last one finishing
+    seconds = max(download.end_time for download in downloads) - min(
+        download.start_time for download in downloads
+    )
+    n_failed = sum(download.error is not None for download in downloads)
+    n_mb = sum(download.n_bytes for download in downloads) / 1024**2
+    print(
+        f"[downloads] {source}: {len(downloads) - n_failed} files, "
+        f"{n_mb:.1f} MB in {seconds:.1f}s "
+        f"({n_mb / max(seconds, 1e-6):.1f} MB/s), {n_failed} failed"
+    )
+
+
+def download_all(downloads, n_workers=N_WORKERS, mirror_url=None):
+    """
+    download all the files concurrently, using a pool of n_workers threads,
+    and report the throughput per source.
+
+    :param mirror_url: download from this url instead, e.g. a local file
+        server for testing. see get_url.
+    :return: the downloads which succeeded. failed downloads are reported,
+        and have their error set.
+    """
+    session = create_session(n_workers)
+    source2downloads = defaultdict(list)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for download in executor.map(
+            lambda download: _download(session, download, mirror_url),
+            downloads,
+        ):
+            source2downloads[download.source].append(download)
+            if download.error is not None:
+                print(
+                    f"[downloads] failed to download {download.url}: "
+                    f"{download.error}"
+                )
+
+    for source, source_downloads in source2downloads.items():
+        _print_throughput(source, source_downloads)
+
+    return [download for download in downloads if download.error is None]
@@ -1 +1,6 @@
-from mcs.estimators.regression import RegressionEstimator
+from mcs.estimators.compiled import CompiledEstimator, is_compilable
+from mcs.estimators.regression import (
+    RegressionEstimator,
+    train_estimators,
+    get_X,
+)
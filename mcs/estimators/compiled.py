@@ -0,0 +1,132 @@
+import numpy as np
+
+from mcs.log_encoder import LogEncoder
+
+# the pipeline steps of the models which can be compiled
+COMPILABLE_STEP_NAMES = {"polynomialfeatures", "linearregression"}
+# the number of rows which are predicted at once
+CHUNK_SIZE = 2**20
+
+
+def is_compilable(model):
+    """whether the model is a linear or polynomial regression."""
+    return (
+        hasattr(model, "named_steps")
+        and set(model.named_steps) <= COMPILABLE_STEP_NAMES
+        and "linearregression" in model.named_steps
+    )
+
+
+class CompiledEstimator(object):
+    """
+    a trained linear or polynomial regression estimator, as plain numpy
+    coefficients. the log encoding, the scaling, the polynomial expansion and
+    the decoding are fused into a single vectorized kernel, which works on the
+    raw columns, so predicting doesn't copy the frame or build the feature
+    matrix. the rows are processed in chunks, so the memory use is bounded
+    for any number of rows. the predictions equal those of
+    RegressionEstimator.predict, up to floating point rounding. models which
+    are trained on float32 features predict in float32, while the kernel
+    always sums the terms in float64.
+    """
+
+    def __init__(
+        self, x_cols, log_x_idxs, mean, scale, powers, coef, intercept, log_y
+    ):
+        """
+        :param log_x_idxs: the positions of the x cols which are log encoded.
+        :param mean: the mean of the scaler, per x col.
+        :param scale: the scale of the scaler, per x col.
+        :param powers: the power of each x col in each term of the
+            polynomial, with shape (n_terms, n_x_cols).
+        :param coef: the coefficient of each term.
+        :param log_y: whether the target is log encoded.
+        """
+        self.x_cols = x_cols
+        self.log_x_idxs = set(log_x_idxs)
+        self.mean = np.asarray(mean, dtype="float64")
+        self.scale = np.asarray(scale, dtype="float64")
+        self.powers = np.asarray(powers, dtype="int64")
+        # keeps the dtype of the model, which determines the output dtype
+        self.coef = np.asarray(coef)
+        self.intercept = float(intercept)
+        self.log_y = log_y
+
+    @classmethod
+    def from_estimator(cls, estimator):
+        """compile a trained RegressionEstimator. only linear and polynomial
+        regression models can be compiled."""
+        model = estimator._model
+        if not is_compilable(model):
+            raise ValueError(
+                f"only linear and polynomial regressions can be compiled, "
+                f"not {model}"
+            )
+
+        n_x_cols = len(estimator._x_cols)
+        if "polynomialfeatures" in model.named_steps:
+            powers = model.named_steps.polynomialfeatures.powers_
+        else:
+            powers = np.eye(n_x_cols, dtype="int64")
+
+        linear_regression = model.named_steps.linearregression
+        is_log_encoded = isinstance(estimator._encoder, LogEncoder)
+        # the positions the encoder resolved when it was fit, which may be
+        # negative
+        log_x_idxs = (
+            [idx % n_x_cols for idx in estimator._encoder.idxs_to_encode_]
+            if is_log_encoded
+            else []
+        )
+        return cls(
+            x_cols=estimator._x_cols,
+            log_x_idxs=log_x_idxs,
+            mean=estimator._scaler.mean_,
+            scale=estimator._scaler.scale_,
+            powers=powers,
+            coef=linear_regression.coef_,
+            intercept=linear_regression.intercept_,
+            log_y=is_log_encoded,
+        )
+
+    def _get_scaled_cols(self, cols, dtype):
+        scaled_cols = []
+        for i, col in enumerate(cols):
+            x = col.astype(dtype)
+            if i in self.log_x_idxs:
+                np.log(x, out=x)
+            np.subtract(x, self.mean[i : i + 1], out=x)
+            np.divide(x, self.scale[i : i + 1], out=x)
+            scaled_cols.append(x)
+        return scaled_cols
+
+    def _predict_chunk(self, cols, dtype, out):
+        scaled_cols = self._get_scaled_cols(cols, dtype)
+        out.fill(self.intercept)
+        # the buffers are reused for all terms
+        term = np.empty(len(out), dtype=dtype)
+        weighted_term = np.empty(len(out))
+        for coef, powers in zip(self.coef, self.powers):
+            term.fill(1)
+            for scaled_col, power in zip(scaled_cols, powers):
+                for _ in range(power):
+                    np.multiply(term, scaled_col, out=term)
+            np.multiply(term, coef, out=weighted_term)
+            out += weighted_term
+        if self.log_y:
+            np.exp(out, out=out)
+
+    def predict(self, df):
+        # the raw columns, without copying them
+        cols = [df[x_col].to_numpy() for x_col in self.x_cols]
+        # the same dtype as the feature matrix of RegressionEstimator.predict
+        # has, so the scaled values are the same
+        dtype = np.result_type(np.float32, *(col.dtype for col in cols))
+
+        y = np.empty(len(df))
+        for start_idx in range(0, len(df), CHUNK_SIZE):
+            chunk = slice(start_idx, start_idx + CHUNK_SIZE)
+            self._predict_chunk(
+                [col[chunk] for col in cols], dtype, out=y[chunk]
+            )
+        return y.astype(np.result_type(dtype, self.coef.dtype), copy=False)
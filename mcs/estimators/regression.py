@@ -1,43 +1,98 @@
 import pandas as pd
 import numpy as np
 
-from sklearn.model_selection import cross_validate, train_test_split
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import KFold, train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_squared_error, r2_score
 
+from mcs.estimators.compiled import CompiledEstimator
+from mcs.log_encoder import Encoder, as_float_array
 
-class DummyEncoder(object):
-    def encode_X(self, df):
-        return df
 
-    def encode_y(self, series):
-        return series
+class DummyEncoder(Encoder):
+    """doesn't encode anything, but like the other encoders, its results
+    have a float dtype."""
 
-    def decode_X(self, df):
-        return df
+    def __init__(self, x_cols=None, copy=True):
+        self.x_cols = x_cols
+        self.copy = copy
 
-    def decode_y(self, series):
-        return series
+    def transform(self, X, copy=None):
+        X = as_float_array(X, copy=self._get_copy(copy))
+        self._check_X(X)
+        return X
+
+    def inverse_transform(self, X, copy=None):
+        return self.transform(X, copy)
+
+    def transform_y(self, y, copy=None):
+        return as_float_array(y, copy=self._get_copy(copy))
+
+    def inverse_transform_y(self, y, copy=None):
+        return self.transform_y(y, copy)
+
+
+def get_X(df, x_cols):
+    """the x cols of df as a new array, without copying the other
+    columns."""
+    return np.column_stack([df[x_col].to_numpy() for x_col in x_cols])
 
 
 def split_data(df, x_cols, y_col, train_size=0.8, encoder=None):
-    df_train, df_test = train_test_split(
-        df, train_size=train_size, test_size=(1 - train_size), random_state=5
+    """
+    split the data in a train and a test set. only the x cols and the y col
+    are copied. if an encoder is given, it's fit on the train set, and both
+    sets are encoded in place.
+
+    :return: X_train, y_train, X_test, y_test, and the positions in df of the
+        rows of the train and the test set.
+    """
+    train_idxs, test_idxs = train_test_split(
+        np.arange(len(df)),
+        train_size=train_size,
+        test_size=(1 - train_size),
+        random_state=5,
     )
 
+    X = get_X(df, x_cols)
+    y = df[y_col].to_numpy()
+    X_train, X_test = X[train_idxs], X[test_idxs]
+    y_train, y_test = y[train_idxs], y[test_idxs]
+
     if encoder is not None:
-        df_train[x_cols] = encoder.encode_X(df_train[x_cols])
-        df_train[y_col] = encoder.encode_y(df_train[y_col])
-        df_test[x_cols] = encoder.encode_X(df_test[x_cols])
-        df_test[y_col] = encoder.encode_y(df_test[y_col])
+        encoder.fit(X_train)
+        X_train = encoder.transform(X_train, copy=False)
+        y_train = encoder.transform_y(y_train, copy=False)
+        X_test = encoder.transform(X_test, copy=False)
+        y_test = encoder.transform_y(y_test, copy=False)
+
+    return X_train, y_train, X_test, y_test, train_idxs, test_idxs
+
+
+def _fit_model(model, X, y):
+    return clone(model).fit(X, y)
 
-    X_train = df_train[x_cols].values
-    y_train = df_train[y_col].values
 
-    X_test = df_test[x_cols].values
-    y_test = df_test[y_col].values
+def train_estimators(estimators, n_jobs=None):
+    """
+    train the estimators. the models of all estimators, and of all their
+    cross validation folds, are independent, so they're all fit in parallel.
 
-    return X_train, y_train, X_test, y_test, df_train, df_test
+    :param n_jobs: the number of processes to fit the models in, -1 for all
+        cores. if None, they're fit in this process.
+    """
+    estimator_jobs = [estimator._get_fit_jobs() for estimator in estimators]
+    models = Parallel(n_jobs=n_jobs)(
+        job for jobs in estimator_jobs for job in jobs
+    )
+
+    # the models are returned in the order of the jobs
+    start_idx = 0
+    for estimator, jobs in zip(estimators, estimator_jobs):
+        estimator._set_fitted_models(models[start_idx : start_idx + len(jobs)])
+        start_idx += len(jobs)
 
 
 class RegressionEstimator(object):
@@ -54,38 +109,68 @@ class RegressionEstimator(object):
         self._model = model
         self._do_cross_validation = do_cross_validation
         self._n_folds = n_folds
-        self._encoder = DummyEncoder() if encoder is None else encoder
+        # the encoder may be shared by several estimators, with other x cols
+        self._encoder = clone(
+            DummyEncoder() if encoder is None else encoder
+        ).set_params(x_cols=x_cols)
 
+        self._df = df
         self._x_cols = x_cols
+        self._y_col = y_col
         (
             self._X_train,
             self._y_train,
             self._X_test,
             self._y_test,
-            self._df_train,
-            self._df_test,
+            self._train_idxs,
+            self._test_idxs,
         ) = split_data(df, x_cols=x_cols, y_col=y_col, encoder=self._encoder)
 
-        self._scaler = StandardScaler()
+        # the arrays are our own, so they're scaled in place
+        self._scaler = StandardScaler(copy=False)
         self._X_train = self._scaler.fit_transform(self._X_train)
         self._X_test = self._scaler.transform(self._X_test)
 
-    def train(self):
+    def _get_rows(self, idxs):
+        # only the x cols and the y col, so we don't copy the whole frame
+        cols = list(dict.fromkeys(self._x_cols + [self._y_col]))
+        return self._df.iloc[idxs, self._df.columns.get_indexer(cols)]
+
+    @property
+    def _df_train(self):
+        """the (unencoded) x cols and y col of the train set."""
+        return self._get_rows(self._train_idxs)
+
+    @property
+    def _df_test(self):
+        """the (unencoded) x cols and y col of the test set."""
+        return self._get_rows(self._test_idxs)
+
+    def _get_fit_jobs(self):
         # fit anyway, even if we're doing cv, because if we're training a
         # pipeline, the non-regressor components aren't being fit properly with
         # our custom cross validation
-        self._model.fit(self._X_train, self._y_train)
+        jobs = [delayed(_fit_model)(self._model, self._X_train, self._y_train)]
+
+        if self._do_cross_validation:
+            # the same (unshuffled) folds as cross_validate uses
+            for train_idxs, _ in KFold(self._n_folds).split(self._X_train):
+                jobs.append(
+                    delayed(_fit_model)(
+                        self._model,
+                        self._X_train[train_idxs],
+                        self._y_train[train_idxs],
+                    )
+                )
+        return jobs
+
+    def _set_fitted_models(self, models):
+        self._model = models[0]
 
         if not self._do_cross_validation:
             return
 
-        results = cross_validate(
-            self._model,
-            self._X_train,
-            self._y_train,
-            cv=self._n_folds,
-            return_estimator=True,
-        )
+        results = {"estimator": models[1:]}
         self._results = results
         coefs = []
         intercepts = []
@@ -110,17 +195,48 @@ class RegressionEstimator(object):
             self._model.coef_ = mean_coef
             self._model.intercept_ = mean_intercept
 
+    def train(self, n_jobs=None):
+        train_estimators([self], n_jobs=n_jobs)
+
+    def get_artifact(self):
+        """everything which is needed to predict, without the training data,
+        so a trained estimator can be stored and restored with
+        from_artifact."""
+        return {
+            "model": self._model,
+            "scaler": self._scaler,
+            "encoder": self._encoder,
+            "x_cols": self._x_cols,
+        }
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        """restore a trained estimator. it can only predict, as it doesn't
+        have the training data."""
+        estimator = cls.__new__(cls)
+        estimator._model = artifact["model"]
+        estimator._scaler = artifact["scaler"]
+        estimator._encoder = artifact["encoder"]
+        estimator._x_cols = artifact["x_cols"]
+        return estimator
+
+    def compile(self):
+        """export the trained model as a CompiledEstimator, which predicts
+        much faster. only linear and polynomial regressions can be
+        compiled."""
+        return CompiledEstimator.from_estimator(self)
+
     def predict(self, df):
-        df_encoded = self._encoder.encode_X(df)
-        X_train = df_encoded[self._x_cols].values
-        X_train = self._scaler.transform(X_train)
-        y_pred = self._model.predict(X_train)
-        return self._encoder.decode_y(y_pred)
+        # X is a new array, so it's encoded and scaled in place
+        X = self._encoder.transform(get_X(df, self._x_cols), copy=False)
+        X = self._scaler.transform(X, copy=False)
+        y_pred = self._model.predict(X)
+        return self._encoder.inverse_transform_y(y_pred, copy=False)
 
     def test(self):
         y_pred = self._model.predict(self._X_test)
-        y_pred_decoded = self._encoder.decode_y(y_pred)
-        y_test_decoded = self._encoder.decode_y(self._y_test)
+        y_pred_decoded = self._encoder.inverse_transform_y(y_pred, copy=False)
+        y_test_decoded = self._encoder.inverse_transform_y(self._y_test)
 
         r2 = r2_score(y_test_decoded, y_pred_decoded)
         rmse = np.sqrt(mean_squared_error(y_test_decoded, y_pred_decoded))
@@ -132,6 +248,6 @@ class RegressionEstimator(object):
                 "y_test": y_test_decoded,
                 "y_pred": y_pred_decoded,
             },
-            index=self._df_test.index,
+            index=self._df.index[self._test_idxs],
         )
         return r2, rmse, results_df
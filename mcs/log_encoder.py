@@ -1,22 +1,116 @@
 import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
 
 
-class LogEncoder(object):
-    def __init__(self, x_cols_to_encode):
-        self._x_cols_to_encode = x_cols_to_encode
+def as_float_array(X, copy=True):
+    """X as a numpy array with a float dtype, so it can be transformed in
+    place. it's copied if copy is True, or if it has to be cast."""
+    X = np.asarray(X)
+    return np.array(X, dtype=np.result_type(X.dtype, np.float32), copy=copy)
 
-    def encode_X(self, df):
-        df = df.copy()
-        df[self._x_cols_to_encode] = np.log(df[self._x_cols_to_encode])
-        return df
 
-    def encode_y(self, series):
-        return np.log(series)
+class Encoder(BaseEstimator, TransformerMixin):
+    """
+    the interface of the encoders. like the sklearn transformers, they work
+    on numpy arrays of the x cols (or frames with these columns), so they can
+    be embedded in a pipeline. besides, they encode the target with
+    transform_y and inverse_transform_y. the results always have a float
+    dtype. with copy=False, float arrays are transformed in place.
+    """
 
-    def decode_X(self, df):
-        df = df.copy()
-        df[self._x_cols_to_encode] = np.exp(df[self._x_cols_to_encode])
-        return df
+    def _get_copy(self, copy):
+        return self.copy if copy is None else copy
 
-    def decode_y(self, series):
-        return np.exp(series)
+    def _check_X(self, X):
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(
+                f"X has shape {X.shape}, but {type(self).__name__} was fit "
+                f"on {self.n_features_in_} features"
+            )
+
+    def fit(self, X, y=None):
+        if hasattr(X, "columns"):
+            self.feature_names_in_ = np.asarray(X.columns, dtype=object)
+        elif hasattr(self, "feature_names_in_"):
+            del self.feature_names_in_
+        self.n_features_in_ = np.shape(X)[1]
+        return self
+
+    def get_feature_names_out(self, input_features=None):
+        # the encoders transform the features one to one
+        if input_features is not None:
+            return np.asarray(input_features, dtype=object)
+        if hasattr(self, "feature_names_in_"):
+            return self.feature_names_in_
+        if self.x_cols is not None:
+            return np.asarray(self.x_cols, dtype=object)
+        return np.asarray(
+            [f"x{i}" for i in range(self.n_features_in_)], dtype=object
+        )
+
+
+class LogEncoder(Encoder):
+    """takes the log of some of the x cols, and of the target. only the
+    encoded columns are transformed."""
+
+    def __init__(self, x_cols_to_encode=(), x_cols=None, copy=True):
+        """
+        :param x_cols_to_encode: the names of the x cols to encode, or their
+            positions.
+        :param x_cols: the names of the columns of the arrays which are
+            transformed. if None, they're the columns of the frame it's fit
+            on. they're only needed to encode cols by name.
+        """
+        self.x_cols_to_encode = x_cols_to_encode
+        self.x_cols = x_cols
+        self.copy = copy
+
+    def fit(self, X, y=None):
+        super().fit(X, y)
+        x_cols = self.x_cols
+        if x_cols is None and hasattr(self, "feature_names_in_"):
+            x_cols = list(self.feature_names_in_)
+
+        self.idxs_to_encode_ = []
+        for x_col in self.x_cols_to_encode:
+            if isinstance(x_col, (int, np.integer)):
+                idx = x_col
+            elif x_cols is None:
+                raise ValueError(
+                    f"can't find x col {x_col!r}: X doesn't have column "
+                    "names, so pass x_cols, or the positions of the x cols "
+                    "to encode"
+                )
+            elif x_col not in x_cols:
+                raise ValueError(f"x col {x_col!r} isn't in {x_cols}")
+            else:
+                idx = list(x_cols).index(x_col)
+
+            if not -self.n_features_in_ <= idx < self.n_features_in_:
+                raise ValueError(
+                    f"x col {idx} is out of range for "
+                    f"{self.n_features_in_} features"
+                )
+            self.idxs_to_encode_.append(idx)
+        return self
+
+    def _apply(self, func, X, copy):
+        X = as_float_array(X, copy=self._get_copy(copy))
+        self._check_X(X)
+        for idx in self.idxs_to_encode_:
+            func(X[:, idx], out=X[:, idx])
+        return X
+
+    def transform(self, X, copy=None):
+        return self._apply(np.log, X, copy)
+
+    def inverse_transform(self, X, copy=None):
+        return self._apply(np.exp, X, copy)
+
+    def transform_y(self, y, copy=None):
+        y = as_float_array(y, copy=self._get_copy(copy))
+        return np.log(y, out=y)
+
+    def inverse_transform_y(self, y, copy=None):
+        y = as_float_array(y, copy=self._get_copy(copy))
+        return np.exp(y, out=y)
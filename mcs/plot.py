@@ -169,7 +169,7 @@ def tsplot(
 
     if x not in data and "timestamp" in data:
         data = data.copy()
-        set_timestamp_related_cols(data)
+        set_timestamp_related_cols(data, cols=[x])
 
     if ax is None:
         plt.figure(figsize=(11, 7))
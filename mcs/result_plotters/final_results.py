@@ -79,7 +79,7 @@ class PlotsGenerator(object):
 
         if kwargs.get("hue") == "is_weekday":
             if "is_weekday" not in data:
-                utils.set_timestamp_related_cols(data)
+                utils.set_timestamp_related_cols(data, cols=["is_weekday"])
             if set(data.is_weekday.unique()) == {True, False}:
                 data.is_weekday = data.is_weekday.map(
                     {False: "Weekend", True: "Week"}
@@ -138,7 +138,7 @@ class PlotsGenerator(object):
         )
         if sensor_name_whitelist:
             df = df[df.sensor_name.isin(sensor_name_whitelist)]
-        utils.set_timestamp_related_cols(df)
+        utils.set_timestamp_related_cols(df, cols=["time_of_day"])
         plt.figure(figsize=(11, 7))
         ax = sns.lineplot(
             data=df,
@@ -283,7 +283,7 @@ class PlotsGenerator(object):
                 label="relative humidity < 85", ax=ax
             )
 
-        utils.set_timestamp_related_cols(ams1_df)
+        utils.set_timestamp_related_cols(ams1_df, cols=["date"])
         plot.add_vfills_working_hours(ax, ams1_df.date)
         if full_ylim:
             ax.set_ylim(full_ylim)
@@ -296,7 +296,7 @@ class PlotsGenerator(object):
         plt.title(f"{component_pretty} for AMS1 over entire experiment")
         self._plot_saver.savefig(f"full_{component}/ams1_entire_experiment")
 
-        utils.set_timestamp_related_cols(ams1_df)
+        utils.set_timestamp_related_cols(ams1_df, cols=["date"])
 
         for date in ams1_df.date.unique():
             plt.figure(figsize=(11, 7))
@@ -400,7 +400,7 @@ class PlotsGenerator(object):
             )
             .melt(var_name="variable", value_name="pm25", ignore_index=False)
         ).reset_index()
-        utils.set_timestamp_related_cols(df)
+        utils.set_timestamp_related_cols(df, cols=["time_of_day"])
         self._plot_daily("pm25", hue="variable", data=df, ax=ax)
         ax.set_ylim((0, 45))
         self._plot_saver.savefig("infographic/pm25_uncalibrated_vs_calibrated")
@@ -410,7 +410,9 @@ class PlotsGenerator(object):
         ax = plt.gca()
 
         df = self._tensec_df.loc["ams1"].reset_index()
-        utils.set_timestamp_related_cols(df)
+        utils.set_timestamp_related_cols(
+            df, cols=["time_of_day", "is_weekday"]
+        )
         df["is_weekday"] = df["is_weekday"].map(
             {False: "Weekend (ams1)", True: "During week (ams1)"}
         )
@@ -427,7 +429,7 @@ class PlotsGenerator(object):
         ax = plt.gca()
 
         df = self._tensec_df.loc[["ams1", "ams3", "ams4"]].reset_index()
-        utils.set_timestamp_related_cols(df)
+        utils.set_timestamp_related_cols(df, cols=["time_of_day"])
         self._plot_daily("pm25_calibrated_nobg", ax=ax, data=df)
         self._plot_saver.savefig("infographic/pm25_bg_subtracted_per_sensor")
 
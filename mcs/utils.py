@@ -2,10 +2,24 @@ import os
 import sys
 import json
 import calendar
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
 from mcs.constants import DATE_FOR_RELATIVE_TIME_OF_DAY
 
+# the columns which are created by set_timestamp_related_cols
+TIMESTAMP_RELATED_COLUMNS = [
+    "date",
+    "day_of_week",
+    "time_of_day",
+    "is_weekday",
+]
+
+NS_PER_DAY = 24 * 60 * 60 * 10**9
+# 1970-01-01, the first day of the epoch, was a thursday
+EPOCH_DAY_OF_WEEK = 3
+
 
 def load_json(fpath):
     with open(fpath) as f:
@@ -26,6 +40,200 @@ def get_ts_dfknmi(df, ts_col="timestamp", resample_to=None):
     return ts_df
 
 
+def map_in_processes(fn, items, n_workers=None):
+    """map fn over items, using a pool of n_workers processes. if n_workers is
+    None or 1, the items are mapped in the current process. fn must be
+    picklable (e.g. a module-level function or a method of a picklable
+    object). the results are returned in the order of the items."""
+    items = list(items)
+    if n_workers is None or n_workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(items))) as pool:
+        return list(pool.map(fn, items))
+
+
+def get_inclusive_time_bounds(start=None, end=None):
+    """convert start and end into inclusive timestamp bounds. like in
+    df.loc[start:end], a partial datetime string such as "2022-12-06" covers
+    the whole period it describes (so it ends at 23:59:59.999999999)."""
+
+    def _get_bound(value, period_attr):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return getattr(pd.Period(value), period_attr)
+        return pd.Timestamp(value)
+
+    return _get_bound(start, "start_time"), _get_bound(end, "end_time")
+
+
+def ranges_overlap(start, end, range_start, range_end):
+    """check whether the range [range_start, range_end] overlaps with the
+    window [start, end]. a bound of None is unbounded."""
+    if start is not None and range_end is not None and range_end < start:
+        return False
+    if end is not None and range_start is not None and range_start > end:
+        return False
+    return True
+
+
+def constant_categorical(value, length):
+    """a categorical of the given length which only contains value. this is
+    used for columns like the source file, which are the same for all rows
+    of a file, so they don't take a python string per row."""
+    return pd.Categorical.from_codes(
+        np.zeros(length, dtype="int8"), categories=[value]
+    )
+
+
+def concat_keeping_categoricals(objs, **kwargs):
+    """pd.concat, but the categorical columns stay categorical.
+
+    pd.concat falls back to object columns whenever the categories differ
+    between the dataframes, so we first give each categorical column the
+    union of all categories. the categories are sorted, so sorting on the
+    column still sorts on its values.
+    """
+    keys = None
+    if isinstance(objs, dict):
+        keys = list(objs.keys())
+        objs = list(objs.values())
+    else:
+        objs = list(objs)
+
+    categorical_columns = [
+        col
+        for col in (objs[0].columns if objs else [])
+        if all(
+            col in df and isinstance(df[col].dtype, pd.CategoricalDtype)
+            for df in objs
+        )
+        # columns with the same categories everywhere already stay
+        # categorical
+        and any(df[col].dtype != objs[0][col].dtype for df in objs)
+    ]
+    col2dtype = {
+        col: pd.CategoricalDtype(
+            pd.api.types.union_categoricals(
+                [df[col] for df in objs], sort_categories=True
+            ).categories
+        )
+        for col in categorical_columns
+    }
+    if col2dtype:
+        objs = [df.astype(col2dtype) for df in objs]
+
+    if keys is not None:
+        objs = dict(zip(keys, objs))
+    return pd.concat(objs, **kwargs)
+
+
+def stack_keeping_categoricals(df):
+    """df.stack(), but the categorical columns stay categorical.
+
+    df.stack() turns categorical columns into object columns when the
+    dataframe also contains other dtypes. after unstacking, all the
+    sub-columns of a categorical column share the same categories, so we
+    stack their codes instead and rebuild the categoricals afterwards.
+    """
+    col2dtype = {
+        col: dtype
+        for col, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.CategoricalDtype)
+    }
+    if not col2dtype:
+        return df.stack()
+
+    df = df.copy()
+    for col, dtype in col2dtype.items():
+        # missing values get code -1, which we turn into nans so they're
+        # still dropped by the stacking like before
+        codes = df[col].cat.codes.astype("float32")
+        df[col] = codes.where(codes >= 0)
+
+    df = df.stack()
+    top_level2dtype = {col[0]: dtype for col, dtype in col2dtype.items()}
+    for col, dtype in top_level2dtype.items():
+        df[col] = pd.Categorical.from_codes(
+            df[col].fillna(-1).astype("int64"), dtype=dtype
+        )
+    return df
+
+
+def average_per_time_bin(df, key_columns, freq="5s", time_col="timestamp"):
+    """take the mean of the numeric columns per time bin of size freq and per
+    unique combination of the key columns. this is a vectorized equivalent of
+
+        df.groupby([pd.Grouper(freq=freq, key=time_col), *key_columns])
+        .mean()
+        .reset_index()
+
+    which sorts on integer bins with numpy, instead of letting pandas group
+    on all (often string) key columns. like the groupby, rows with a missing
+    timestamp or key are dropped, the result is sorted on the bin and keys,
+    non-numeric columns which aren't keys are dropped, and float32 columns
+    stay float32.
+    """
+    key_columns = list(key_columns)
+    value_columns = [
+        col
+        for col in df.columns
+        if col != time_col
+        and col not in key_columns
+        and pd.api.types.is_numeric_dtype(df[col])
+    ]
+
+    timestamps = df[time_col]
+    is_valid = timestamps.notna().values
+    bins = timestamps.values.view("i8") // pd.Timedelta(freq).value
+
+    key2codes = {}
+    key2uniques = {}
+    for col in key_columns:
+        codes, uniques = pd.factorize(df[col], sort=True)
+        # missing keys get code -1
+        is_valid &= codes >= 0
+        key2codes[col] = codes
+        key2uniques[col] = uniques
+
+    # sort on the bin first, then on the keys in the given order
+    bins = bins[is_valid]
+    key2codes = {col: codes[is_valid] for col, codes in key2codes.items()}
+    order = np.lexsort([*reversed(list(key2codes.values())), bins])
+    bins = bins[order]
+    key2codes = {col: codes[order] for col, codes in key2codes.items()}
+
+    # find where each group starts in the sorted rows
+    is_group_start = np.ones(len(bins), dtype=bool)
+    is_group_start[1:] = bins[1:] != bins[:-1]
+    for codes in key2codes.values():
+        is_group_start[1:] |= codes[1:] != codes[:-1]
+    group_starts = np.flatnonzero(is_group_start)
+
+    result = {
+        time_col: pd.to_datetime(bins[group_starts] * pd.Timedelta(freq).value)
+    }
+    for col in key_columns:
+        result[col] = key2uniques[col].take(key2codes[col][group_starts])
+
+    if len(group_starts) > 0:
+        values = df[value_columns].to_numpy(dtype="float64")[is_valid][order]
+        is_nan = np.isnan(values)
+        sums = np.add.reduceat(np.where(is_nan, 0.0, values), group_starts)
+        counts = np.add.reduceat(~is_nan, group_starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
+    else:
+        means = np.empty((0, len(value_columns)))
+
+    for i, col in enumerate(value_columns):
+        dtype = "float32" if df[col].dtype == "float32" else "float64"
+        result[col] = means[:, i].astype(dtype)
+
+    return pd.DataFrame(result)
+
+
 def query_yes_no(
     question, default=None, remark_if_yes=None, remark_if_no=None
 ):
@@ -70,31 +278,79 @@ def query_yes_no(
     return outcome
 
 
-def set_timestamp_related_cols(df, src_col="timestamp"):
+def set_timestamp_related_cols(df, src_col="timestamp", cols=None):
+    """add the columns in TIMESTAMP_RELATED_COLUMNS, which are derived from
+    the timestamps. everything is computed with integer arithmetic on the
+    nanoseconds since the epoch, so this is cheap even for large dataframes.
+    timezone aware timestamps are used in their local time. for NaT, the
+    date and day of week are missing, the time of day is NaT and is_weekday
+    is False.
+
+    :param cols: optionally, only add these columns (e.g. ["time_of_day"]
+        when only plotting the daily pattern). by default, all are added.
+    """
+    if cols is None:
+        cols = TIMESTAMP_RELATED_COLUMNS
+    unknown_cols = set(cols) - set(TIMESTAMP_RELATED_COLUMNS)
+    if unknown_cols:
+        raise ValueError(f"unknown columns: {sorted(unknown_cols)}")
+
     timestamp_is_index = "timestamp" not in df and isinstance(
         df.index, pd.DatetimeIndex
     )
 
     if timestamp_is_index:
-        timestamps = df.index.to_series()
+        timestamps = df.index
+        if timestamps.tz is not None:
+            # the local time, instead of utc
+            timestamps = timestamps.tz_localize(None)
     else:
         timestamps = df[src_col]
+        if timestamps.dt.tz is not None:
+            timestamps = timestamps.dt.tz_localize(None)
+    ns = timestamps.values.view("i8")
+    is_nat = ns == pd.NaT.value
+    has_nat = is_nat.any()
+    # floor division, so timestamps before the epoch end up on the right day
+    days = ns // NS_PER_DAY
+
+    # create date column. it's categorical, since there are only a few
+    # unique dates
+    if "date" in cols:
+        if has_nat:
+            date_codes = np.full(len(days), -1)
+            date_codes[~is_nat], unique_days = pd.factorize(
+                days[~is_nat], sort=True
+            )
+        else:
+            date_codes, unique_days = pd.factorize(days, sort=True)
+        dates = pd.to_datetime(unique_days * NS_PER_DAY).date
+        df["date"] = pd.Categorical.from_codes(date_codes, categories=dates)
 
-    # create date column
-    df["date"] = timestamps.dt.date
     # create day of week column
-    cat_type = pd.CategoricalDtype(list(calendar.day_name), ordered=True)
-    df["day_of_week"] = pd.Categorical.from_codes(
-        timestamps.dt.day_of_week, dtype=cat_type
-    )
-    # create normalized date column
-    df["time_of_day"] = pd.to_datetime(
-        DATE_FOR_RELATIVE_TIME_OF_DAY + " " + timestamps.dt.time.astype(str)
-    )
+    day_of_week_codes = (days + EPOCH_DAY_OF_WEEK) % 7
+    if has_nat:
+        day_of_week_codes[is_nat] = -1
+    if "day_of_week" in cols:
+        cat_type = pd.CategoricalDtype(list(calendar.day_name), ordered=True)
+        df["day_of_week"] = pd.Categorical.from_codes(
+            day_of_week_codes, dtype=cat_type
+        )
 
-    df["is_weekday"] = (
-        ~df["day_of_week"].str.lower().isin(["saturday", "sunday"])
-    )
+    # create normalized date column, i.e. the time of the day on
+    # DATE_FOR_RELATIVE_TIME_OF_DAY
+    if "time_of_day" in cols:
+        ns_of_day = ns - days * NS_PER_DAY
+        time_of_day_ns = (
+            pd.Timestamp(DATE_FOR_RELATIVE_TIME_OF_DAY).value + ns_of_day
+        )
+        if has_nat:
+            time_of_day_ns[is_nat] = pd.NaT.value
+        df["time_of_day"] = time_of_day_ns.view("datetime64[ns]")
+
+    if "is_weekday" in cols:
+        # monday is 0, so saturday and sunday are 5 and 6. NaT is -1
+        df["is_weekday"] = (day_of_week_codes >= 0) & (day_of_week_codes < 5)
 
 
 def rm_dir_contents(dir):
@@ -18,9 +18,12 @@ MIT_EXPERIMENT_NAME = "final-city-scanner-data"
 MIT_CS_IDS = ["ams3", "ams4"]
 # loading the data
 mit_cs_id2df = {
-    mit_cs_id: mit_data_loader.load_data(MIT_EXPERIMENT_NAME, mit_cs_id).loc[
-        MEASUREMENT_RANGE, :
-    ]
+    mit_cs_id: mit_data_loader.load_data(
+        MIT_EXPERIMENT_NAME,
+        mit_cs_id,
+        start=MEASUREMENT_RANGE.start,
+        end=MEASUREMENT_RANGE.stop,
+    )
     for mit_cs_id in MIT_CS_IDS
 }
 
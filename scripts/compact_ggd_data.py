@@ -0,0 +1,16 @@
+import fire
+
+from mcs.data_loaders import GGDDataLoader
+
+
+def compact_ggd_data():
+    """
+    compact the GGD and luchtmeetnet csvs into the GGD store, so loading the
+    GGD data doesn't need to parse the csvs anymore. rerun this after
+    fetching new data; until then, the csvs are read instead.
+    """
+    GGDDataLoader().compact()
+
+
+if __name__ == "__main__":
+    fire.Fire(compact_ggd_data)
@@ -0,0 +1,21 @@
+import fire
+
+from mcs.constants import KNMI_DATA_DIR
+from mcs.data_loaders import KNMIDataLoader
+
+
+def compact_knmi_data():
+    """
+    convert the hourly KNMI data of all stations into the KNMI store, so
+    loading it doesn't need to parse the txt files anymore. rerun this after
+    fetching new data; until then, the txt files are read instead.
+    """
+    data_loader = KNMIDataLoader()
+    for fpath in sorted(KNMI_DATA_DIR.glob("uurgeg_*_2021-2030.txt")):
+        station_code = fpath.name.split("_")[1]
+        print(f"converting the data of station {station_code}")
+        data_loader.compact(station_code)
+
+
+if __name__ == "__main__":
+    fire.Fire(compact_knmi_data)
@@ -0,0 +1,38 @@
+import fire
+
+from fetch_ggd_data import (
+    get_ggd_downloads,
+    update_sync_manifest_with_downloads,
+)
+from fetch_gvb_data import get_gvb_downloads
+from fetch_knmi_data import get_knmi_downloads
+from mcs.constants import GGD_YEARS
+from mcs.downloads import download_all, N_WORKERS
+
+
+def fetch_all_data(
+    years=GGD_YEARS, only_missing=True, n_workers=N_WORKERS, mirror_url=None
+):
+    """
+    fetch the KNMI, GVB and GGD data concurrently. the throughput is reported
+    per source.
+
+    :param years: the GGD years to fetch, see fetch_ggd_data.
+    :param only_missing: skip the GGD files which are up to date.
+    :param mirror_url: download from this url instead, e.g. a local file
+        server for testing, with the same paths as the real servers.
+    """
+    downloads = download_all(
+        get_knmi_downloads()
+        + get_gvb_downloads()
+        + get_ggd_downloads(years, only_missing, n_workers, mirror_url),
+        n_workers=n_workers,
+        mirror_url=mirror_url,
+    )
+    update_sync_manifest_with_downloads(
+        [download for download in downloads if download.source == "ggd"]
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(fetch_all_data)
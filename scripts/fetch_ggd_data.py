@@ -1,11 +1,18 @@
 import fire
-import requests
-import os
 from datetime import date
+from mcs import cache
+from mcs.downloads import (
+    Download,
+    download_all,
+    create_session,
+    get_url,
+    N_WORKERS,
+)
 from mcs.constants import (
     GGD_DATA_DIR,
     GGD_YEARS,
     GGD_COMPONENTS,
+    GGD_SYNC_MANIFEST_FPATH,
 )
 
 GGD_LUCHTMEETNET_COMPLETED_YEAR_BASE_URL = (
@@ -16,15 +23,64 @@ GGD_LUCHTMEETNET_CURRENT_YEAR_BASE_URL = (
 )
 
 
-def fetch_ggd_data(years=GGD_YEARS):
+def read_sync_manifest():
+    """the manifest of the fetched files, by their path relative to
+    GGD_DATA_DIR."""
+    return cache.read_manifest(GGD_SYNC_MANIFEST_FPATH) or {}
+
+
+def update_sync_manifest(fpath, **entry):
+    manifest = read_sync_manifest()
+    manifest[str(fpath.relative_to(GGD_DATA_DIR))] = entry
+    cache.write_manifest(GGD_SYNC_MANIFEST_FPATH, manifest)
+
+
+def is_up_to_date(fpath, manifest):
+    """whether fpath was fetched before, and won't change anymore."""
+    entry = manifest.get(str(fpath.relative_to(GGD_DATA_DIR)))
+    return (
+        fpath.exists()
+        and entry is not None
+        and not entry.get("provisional", True)
+    )
+
+
+def is_unchanged_on_server(session, head_url, url, fpath, manifest):
+    """whether the file at url is still the one we fetched to fpath, based on
+    its ETag or otherwise its Content-Length, as reported for head_url. files
+    which were written by other scripts, e.g. sync_ggd_data, have no url or
+    validators in the manifest, so they're never considered unchanged."""
+    entry = manifest.get(str(fpath.relative_to(GGD_DATA_DIR)))
+    if not fpath.exists() or entry is None or entry.get("url") != url:
+        return False
+    if entry.get("etag") is None and entry.get("content_length") is None:
+        return False
+
+    response = session.head(head_url, allow_redirects=True)
+    if response.status_code != 200:
+        return False
+    etag = response.headers.get("ETag")
+    if etag is not None and entry.get("etag") is not None:
+        return etag == entry["etag"]
+    content_length = response.headers.get("Content-Length")
+    return content_length is not None and content_length == entry.get(
+        "content_length"
+    )
+
+
+def get_ggd_downloads(
+    years=GGD_YEARS, only_missing=False, n_workers=N_WORKERS, mirror_url=None
+):
+    """the downloads of the GGD files, see fetch_ggd_data."""
+    manifest = read_sync_manifest()
+    session = create_session(n_workers)
+
     current_year = str(date.today().year)
+    downloads = []
     for year in years:
-        write_dir = GGD_DATA_DIR / year
-        print(f"writing to {write_dir}")
-        os.makedirs(write_dir, exist_ok=True)
-
         for component in GGD_COMPONENTS:
             filename = year + "_" + component + ".csv"
+            fpath = GGD_DATA_DIR / year / filename
 
             if year.startswith(current_year):
                 url = GGD_LUCHTMEETNET_CURRENT_YEAR_BASE_URL
@@ -33,14 +89,52 @@ def fetch_ggd_data(years=GGD_YEARS):
 
             url += filename
 
-            print(f"downloading {url}")
-            response = requests.get(url)
-
-            if response.status_code != 200:
+            if only_missing and (
+                is_up_to_date(fpath, manifest)
+                or is_unchanged_on_server(
+                    session, get_url(url, mirror_url), url, fpath, manifest
+                )
+            ):
+                print(f"skipping {url}, it's up to date")
                 continue
 
-            with open(os.path.join(write_dir, filename), "wb") as f:
-                f.write(response.content)
+            downloads.append(Download("ggd", url, fpath))
+    return downloads
+
+
+def update_sync_manifest_with_downloads(downloads):
+    for download in downloads:
+        update_sync_manifest(
+            download.fpath,
+            url=download.url,
+            etag=download.headers.get("ETag"),
+            content_length=download.headers.get("Content-Length"),
+            # the files of the current year still change
+            provisional=download.url.startswith(
+                GGD_LUCHTMEETNET_CURRENT_YEAR_BASE_URL
+            ),
+        )
+
+
+def fetch_ggd_data(
+    years=GGD_YEARS, only_missing=False, n_workers=N_WORKERS, mirror_url=None
+):
+    """
+    :param only_missing: skip the files which were fetched before. the files
+        of completed years are final, so these are never fetched again. the
+        file of the current year is still provisional, so it's only fetched
+        again if it changed on the server.
+    :param mirror_url: download from this url instead, e.g. a local file
+        server with the same paths as the RIVM server.
+    :return: the paths of the files which were written.
+    """
+    downloads = download_all(
+        get_ggd_downloads(years, only_missing, n_workers, mirror_url),
+        n_workers=n_workers,
+        mirror_url=mirror_url,
+    )
+    update_sync_manifest_with_downloads(downloads)
+    return [download.fpath for download in downloads]
 
 
 if __name__ == "__main__":
@@ -1,6 +1,6 @@
-import requests
-import json
+import fire
 from mcs.constants import GVB_DATA_DIR
+from mcs.downloads import Download, download_all, N_WORKERS
 
 dataset_name2url = {
     "hdvries-away-2022": "https://maps.gvb.nl/api/v1/stop-timetables/stop-00065-hugo-de-vrieslaan-line-19-away-diemen-sniep-20220828-20221210.json",
@@ -8,16 +8,22 @@ dataset_name2url = {
 }
 
 
-def fetch_data(name, url):
-    data = requests.get(url).json()
+def get_gvb_downloads():
+    return [
+        Download("gvb", url, GVB_DATA_DIR / f"{name}.json")
+        for name, url in dataset_name2url.items()
+    ]
 
-    KNMI_DATA_DIR.mkdir(exist_ok=True)
-    fpath = GVB_DATA_DIR / f"{name}.json"
 
-    with open(fpath, "w") as f:
-        f.write(json.dumps(data))
+def fetch_gvb_data(n_workers=N_WORKERS, mirror_url=None):
+    """
+    :param mirror_url: download from this url instead, e.g. a local file
+        server with the same paths as the GVB api.
+    """
+    download_all(
+        get_gvb_downloads(), n_workers=n_workers, mirror_url=mirror_url
+    )
 
 
 if __name__ == "__main__":
-    for dataset_name, url in dataset_name2url.items():
-        fetch_data(dataset_name, url)
+    fire.Fire(fetch_gvb_data)
@@ -1,28 +1,35 @@
-import requests
+import fire
 from mcs.constants import KNMI_DATA_DIR
-import zipfile
-from io import BytesIO
-
+from mcs.downloads import Download, download_all, N_WORKERS
 
 # 240 = schiphol
 # 344 = rotterdam
+KNMI_URLS = [
+    "https://cdn.knmi.nl/knmi/map/page/klimatologie/gegevens/daggegevens/etmgeg_240.zip",
+    "https://cdn.knmi.nl/knmi/map/page/klimatologie/gegevens/uurgegevens/uurgeg_240_2021-2030.zip",
+    "https://cdn.knmi.nl/knmi/map/page/klimatologie/gegevens/uurgegevens/uurgeg_344_2021-2030.zip",
+]
 
 
-def get_data_for():
-    urls = [
-        "https://cdn.knmi.nl/knmi/map/page/klimatologie/gegevens/daggegevens/etmgeg_240.zip",
-        "https://cdn.knmi.nl/knmi/map/page/klimatologie/gegevens/uurgegevens/uurgeg_240_2021-2030.zip",
-        "https://cdn.knmi.nl/knmi/map/page/klimatologie/gegevens/uurgegevens/uurgeg_344_2021-2030.zip",
+def get_knmi_downloads():
+    # the zips are extracted into KNMI_DATA_DIR
+    return [
+        Download(
+            "knmi", url, KNMI_DATA_DIR / url.rsplit("/", 1)[1], unzip=True
+        )
+        for url in KNMI_URLS
     ]
 
-    for url in urls:
-        response = requests.get(url)
-        # unzip that bad boy
-        zippy = zipfile.ZipFile(BytesIO(response.content))
-        KNMI_DATA_DIR.mkdir(exist_ok=True)
-        fpath = KNMI_DATA_DIR
-        zippy.extractall(fpath)
+
+def get_data_for(n_workers=N_WORKERS, mirror_url=None):
+    """
+    :param mirror_url: download from this url instead, e.g. a local file
+        server with the same paths as the KNMI cdn.
+    """
+    download_all(
+        get_knmi_downloads(), n_workers=n_workers, mirror_url=mirror_url
+    )
 
 
 if __name__ == "__main__":
-    get_data_for()
+    fire.Fire(get_data_for)
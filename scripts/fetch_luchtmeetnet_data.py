@@ -1,12 +1,20 @@
+import os
 import json
+import asyncio
+import hashlib
 import pandas as pd
 import requests
 import fire
 from collections import defaultdict
 from datetime import datetime, timedelta
 from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
 
-from mcs.constants import GGD_AMSTERDAM_STATION_CODES, GGD_DATA_DIR
+from mcs.constants import (
+    GGD_AMSTERDAM_STATION_CODES,
+    GGD_DATA_DIR,
+    LUCHTMEETNET_CACHE_DIR,
+)
 
 COLUMNS = [
     "Component",
@@ -83,7 +91,15 @@ COMPONENT_NAME2COMPONENT_ID = {
 
 PROVINCE_ID = "4a8fec5e-c1d3-49f3-84a3-28be30ae005e"
 
-MEASUREMENTS_URL = "https://api2020.luchtmeetnet.nl/measurements"
+BASE_URL = "https://api2020.luchtmeetnet.nl"
+
+# the maximum number of requests which are done at the same time
+N_CONCURRENT_REQUESTS = 8
+# failed requests are retried this many times, waiting
+# BACKOFF_SECONDS * 2 ** attempt in between
+N_RETRIES = 4
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT_SECONDS = 60
 
 
 def prepend_newlines(fpath, nlines):
@@ -94,26 +110,105 @@ def prepend_newlines(fpath, nlines):
         file.write(s + content)
 
 
-def get_result_df(url):
-    response = requests.get(url)
-    body = json.loads(response.content)
-    if "result" not in body:
-        breakpoint()
-    return pd.DataFrame(body["result"])
+class LuchtmeetnetClient(object):
+    """
+    fetches results from the luchtmeetnet api concurrently. the requests are
+    done in a thread pool with a shared connection pool, as requests isn't
+    async itself. successful responses are cached on disk per url, unless
+    they may still change, so a rerun only fetches what's missing.
+    """
+
+    def __init__(
+        self,
+        base_url=BASE_URL,
+        n_concurrent_requests=N_CONCURRENT_REQUESTS,
+        n_retries=N_RETRIES,
+        backoff_seconds=BACKOFF_SECONDS,
+        use_cache=True,
+        cache_dir=LUCHTMEETNET_CACHE_DIR,
+    ):
+        self.base_url = base_url
+        self._n_concurrent_requests = n_concurrent_requests
+        self._n_retries = n_retries
+        self._backoff_seconds = backoff_seconds
+        self._use_cache = use_cache
+        self._cache_dir = cache_dir
 
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=n_concurrent_requests
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._semaphore = None
 
-def get_stations_df():
-    url = f"https://api2020.luchtmeetnet.nl/stations?show_website=true&limit=999&province_id={PROVINCE_ID}&measurement_method=active"
-    return get_result_df(url)
+    def _get_cache_fpath(self, url):
+        url_hash = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return self._cache_dir / f"{url_hash}.json"
 
+    def _read_cached_body(self, url, use_cache):
+        fpath = self._get_cache_fpath(url)
+        if not (self._use_cache and use_cache) or not fpath.exists():
+            return None
+        with open(fpath) as f:
+            return json.loads(f.read())
 
-def get_measurements_url(
-    component_id, start_datetime, end_datetime, station_id
-):
-    return (
-        MEASUREMENTS_URL
-        + "/?"
-        + urlencode(
+    def _write_cached_body(self, url, body, use_cache):
+        if not (self._use_cache and use_cache):
+            return
+        fpath = self._get_cache_fpath(url)
+        fpath.parent.mkdir(exist_ok=True, parents=True)
+        tmp_fpath = fpath.with_name(fpath.name + ".tmp")
+        with open(tmp_fpath, "w") as f:
+            f.write(json.dumps(body))
+        os.replace(tmp_fpath, fpath)
+
+    def _get_body(self, url):
+        response = self._session.get(url, timeout=REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        body = json.loads(response.content)
+        if "result" not in body:
+            raise ValueError(f"there is no result in the response of {url}")
+        return body
+
+    async def get_result_df(self, url, use_cache=True):
+        """
+        :param use_cache: whether the response may be cached, e.g. not for
+            periods which aren't over yet, as their results still change.
+        """
+        body = self._read_cached_body(url, use_cache)
+        if body is None:
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(
+                    self._n_concurrent_requests
+                )
+            async with self._semaphore:
+                for attempt in range(self._n_retries + 1):
+                    try:
+                        body = await asyncio.to_thread(self._get_body, url)
+                        break
+                    except (requests.RequestException, ValueError) as e:
+                        if attempt == self._n_retries:
+                            raise
+                        backoff_seconds = self._backoff_seconds * 2**attempt
+                        print(
+                            f"request failed ({e}), retrying in "
+                            f"{backoff_seconds}s"
+                        )
+                        await asyncio.sleep(backoff_seconds)
+            self._write_cached_body(url, body, use_cache)
+        return pd.DataFrame(body["result"])
+
+    def get_stations_url(self):
+        return (
+            f"{self.base_url}/stations?show_website=true&limit=999"
+            f"&province_id={PROVINCE_ID}&measurement_method=active"
+        )
+
+    def get_measurements_url(
+        self, component_id, start_datetime, end_datetime, station_id
+    ):
+        return f"{self.base_url}/measurements/?" + urlencode(
             {
                 "component_id": component_id,
                 "start": (
@@ -133,7 +228,6 @@ def get_measurements_url(
                 "status": "validated,unvalidated",
             }
         )
-    )
 
 
 def yield_daterange_chunks(start, end, nchunks=6):
@@ -146,44 +240,104 @@ def yield_daterange_chunks(start, end, nchunks=6):
         yield bins[i], bins[i + 1]
 
 
-def fetch_luchtmeetnet_data(year_month="2022_11"):
-    year, month = map(int, year_month.split("_"))
-    start_datetime = datetime(year, month, 1)
-    end_datetime = datetime(year, month + 1, 1) + timedelta(seconds=-1)
+async def fetch_station_df(
+    client, component_id, station_id, start_datetime, end_datetime
+):
+    now = datetime.now()
+    urls = []
+    results = []
+    for start, end in yield_daterange_chunks(
+        start_datetime, end_datetime, nchunks=6
+    ):
+        url = client.get_measurements_url(
+            component_id,
+            start.to_pydatetime(),
+            end.to_pydatetime(),
+            station_id,
+        )
+        urls.append(url)
+        results.append(client.get_result_df(url, use_cache=end < now))
+    dfs = []
+    for url, df in zip(urls, await asyncio.gather(*results)):
+        if df.empty:
+            continue
+        if "datetime_from" not in df:
+            raise ValueError(
+                f"there is no datetime_from in the result of {url}"
+            )
+        df["datetime_from"] = pd.to_datetime(df["datetime_from"])
+        df = df.set_index("datetime_from")[["value"]]
+        dfs.append(df)
+    if len(dfs) == 0:
+        return None
+    df = pd.concat(dfs)
+    return df[~df.index.duplicated(keep="first")]
+
 
-    stations_df = get_stations_df()
+async def fetch_component_name2station_code2df(
+    client, start_datetime, end_datetime
+):
+    # the stations change over time, so they're always fetched
+    stations_df = await client.get_result_df(
+        client.get_stations_url(), use_cache=False
+    )
     station_code2id = stations_df.set_index("number")["id"].loc[
         set(GGD_AMSTERDAM_STATION_CODES) & set(stations_df.number.unique())
     ]
 
+    # all stations and components are fetched concurrently
+    keys = [
+        (component_name, component_id, station_code, station_id)
+        for component_name, component_id in COMPONENT_NAME2COMPONENT_ID.items()
+        for station_code, station_id in station_code2id.items()
+    ]
+    dfs = await asyncio.gather(
+        *[
+            fetch_station_df(
+                client, component_id, station_id, start_datetime, end_datetime
+            )
+            for _, component_id, _, station_id in keys
+        ]
+    )
+
     component_name2station_code2df = defaultdict(dict)
+    for (component_name, _, station_code, _), df in zip(keys, dfs):
+        if df is not None:
+            component_name2station_code2df[component_name][station_code] = df
+    return component_name2station_code2df
 
-    for component_name, component_id in COMPONENT_NAME2COMPONENT_ID.items():
-        for station_code, station_id in station_code2id.items():
-            dfs = []
-            for start, end in yield_daterange_chunks(
-                start_datetime, end_datetime, nchunks=6
-            ):
-                url = get_measurements_url(
-                    component_id,
-                    start.to_pydatetime(),
-                    end.to_pydatetime(),
-                    station_id,
-                )
-                df = get_result_df(url)
-                if df.empty:
-                    continue
-                if "datetime_from" not in df:
-                    breakpoint()
-                df["datetime_from"] = pd.to_datetime(df["datetime_from"])
-                df = df.set_index("datetime_from")[["value"]]
-                dfs.append(df)
-            if len(dfs) > 0:
-                df = pd.concat(dfs)
-                df = df[~df.index.duplicated(keep="first")]
-                component_name2station_code2df[component_name][
-                    station_code
-                ] = df
+
+def fetch_luchtmeetnet_data(
+    year_month="2022_11",
+    base_url=BASE_URL,
+    n_concurrent_requests=N_CONCURRENT_REQUESTS,
+    use_cache=True,
+):
+    """
+    :param base_url: the url of the luchtmeetnet api, e.g. a local server
+        for testing.
+    :param use_cache: reuse the measurements of earlier runs, so only the
+        measurements which weren't fetched before are requested. the
+        measurements for periods which aren't over yet, and the stations, are
+        always requested again.
+    :return: the paths of the files which were written.
+    """
+    month = pd.Period(year_month.replace("_", "-"), freq="M")
+    start_datetime = month.start_time.to_pydatetime()
+    end_datetime = (month + 1).start_time.to_pydatetime() + timedelta(
+        seconds=-1
+    )
+
+    client = LuchtmeetnetClient(
+        base_url=base_url,
+        n_concurrent_requests=n_concurrent_requests,
+        use_cache=use_cache,
+    )
+    component_name2station_code2df = asyncio.run(
+        fetch_component_name2station_code2df(
+            client, start_datetime, end_datetime
+        )
+    )
 
     df = pd.concat(
         {
@@ -203,6 +357,7 @@ def fetch_luchtmeetnet_data(year_month="2022_11"):
         columns="station_code",
         values="value",
     )
+    out_fpaths = []
     for component_name in COMPONENT_NAME2COMPONENT_ID.keys():
         df = (
             component_name2df.loc[component_name]
@@ -229,6 +384,9 @@ def fetch_luchtmeetnet_data(year_month="2022_11"):
         df[COLUMNS].to_csv(out_fpath, index=False, sep=";")
         # also, we need extra newlines to match luchtmeetnet format
         prepend_newlines(out_fpath, 7)
+        out_fpaths.append(out_fpath)
+
+    return out_fpaths
 
 
 if __name__ == "__main__":
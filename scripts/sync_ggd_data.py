@@ -0,0 +1,72 @@
+import fire
+import pandas as pd
+from datetime import datetime
+
+from fetch_ggd_data import (
+    fetch_ggd_data,
+    read_sync_manifest,
+    update_sync_manifest,
+    is_up_to_date,
+)
+from fetch_luchtmeetnet_data import (
+    fetch_luchtmeetnet_data,
+    BASE_URL,
+    COMPONENT_NAME2COMPONENT_ID,
+)
+from mcs.constants import GGD_DATA_DIR, GGD_YEARS
+from mcs.data_loaders import GGDDataLoader
+
+
+def sync_luchtmeetnet_data(year_months, base_url=BASE_URL):
+    """fetch the months which weren't fetched before, or which weren't over
+    yet when they were fetched."""
+    manifest = read_sync_manifest()
+    written_fpaths = []
+    for year_month in year_months:
+        fpaths = [
+            GGD_DATA_DIR / year_month / f"{year_month}_{component_name}.csv"
+            for component_name in COMPONENT_NAME2COMPONENT_ID.keys()
+        ]
+        if all(is_up_to_date(fpath, manifest) for fpath in fpaths):
+            print(f"skipping {year_month}, it's up to date")
+            continue
+
+        # check before fetching, so data which arrives during the fetch
+        # never counts as complete
+        month = pd.Period(year_month.replace("_", "-"), freq="M")
+        provisional = (month + 1).start_time >= datetime.now()
+
+        print(f"fetching {year_month} from luchtmeetnet")
+        for fpath in fetch_luchtmeetnet_data(year_month, base_url=base_url):
+            update_sync_manifest(fpath, provisional=provisional)
+            written_fpaths.append(fpath)
+    return written_fpaths
+
+
+def sync_ggd_data(years=GGD_YEARS, base_url=BASE_URL, compact=True):
+    """
+    fetch only the GGD data which is missing, or which may have changed since
+    it was fetched, and add it to the GGD store. what was fetched is kept in
+    a manifest (GGD_SYNC_MANIFEST_FPATH), so files of completed years and
+    completed months are never fetched again.
+
+    :param years: the years (e.g. "2021") and months (e.g. "2022_11") to
+        sync. years are fetched from the yearly RIVM files, months from the
+        luchtmeetnet api.
+    :param base_url: the url of the luchtmeetnet api.
+    :param compact: update the GGD store with the fetched data.
+    """
+    yearly = [year for year in years if "_" not in year]
+    monthly = [year for year in years if "_" in year]
+
+    written_fpaths = fetch_ggd_data(yearly, only_missing=True)
+    written_fpaths += sync_luchtmeetnet_data(monthly, base_url=base_url)
+    print(f"fetched {len(written_fpaths)} files")
+
+    data_loader = GGDDataLoader()
+    if compact and not data_loader.has_up_to_date_store():
+        data_loader.compact()
+
+
+if __name__ == "__main__":
+    fire.Fire(sync_ggd_data)
@@ -1,4 +1,3 @@
-import pandas as pd
 import fire
 
 from mcs.data_loaders import (
@@ -12,27 +11,33 @@ from mcs.constants import (
     CALIBRATION_END_DATETIME,
     EXPERIMENT_START_DATE,
     EXPERIMENT_END_DATE,
+    MIT_SENSOR_NAME2CORRECTIONS,
 )
 from mcs.calibration.input_data_preprocessor import InputDataPreprocessor
-from mcs.calibration.mit_dcmr_calibrator import MITDCMRCalibrator
+from mcs.calibration.mit_dcmr_calibrator import (
+    MITDCMRCalibrator,
+    get_artifact_fpath,
+)
 
+# the columns used by the InputDataPreprocessor
+MIT_COLUMNS = ["PM25", "humidity", "gas_op2_w"]
 
-def write_calibrated_data(
-    mit_experiment_name="final-city-scanner-data",
-    dcmr_experiment_name="schiedam-december-2022",
-    output_name="final-data",
-    calibration_sensor_names=["ams3", "ams4"],
-    experiment_sensor_names=["ams1", "ams2", "ams3", "ams4"],
-    calibration_start_datetime=CALIBRATION_START_DATETIME,
-    calibration_end_datetime=CALIBRATION_END_DATETIME,
-    experiment_start_datetime=EXPERIMENT_START_DATE,
-    experiment_end_datetime=EXPERIMENT_END_DATE,
-    calibration_knmi_station_code="344",
-    experiment_knmi_station_code="240",
-    plot_calibration_training_results=True,
+
+def train_calibrator(
+    calibrator,
+    mit_experiment_name,
+    dcmr_experiment_name,
+    calibration_sensor_names,
+    calibration_start_datetime,
+    calibration_end_datetime,
+    calibration_knmi_station_code,
 ):
     calibration_mit_df = MITDataLoader().load_data(
-        mit_experiment_name, calibration_sensor_names
+        mit_experiment_name,
+        calibration_sensor_names,
+        columns=MIT_COLUMNS,
+        start=calibration_start_datetime,
+        end=calibration_end_datetime,
     )
     calibration_knmi_df = KNMIDataLoader().load_data(
         calibration_knmi_station_code,
@@ -56,9 +61,6 @@ def write_calibrated_data(
     calibration_10sec_df = calibration_data_preprocessor.get_10sec_data()
     calibration_hourly_df = calibration_data_preprocessor.get_hourly_data()
 
-    calibrator = MITDCMRCalibrator(
-        plot_results=plot_calibration_training_results
-    )
     calibrator.train(
         dcmr_10sec_df=dcmr_10sec_df,
         dcmr_hourly_df=dcmr_hourly_df,
@@ -66,40 +68,109 @@ def write_calibrated_data(
         train_hourly_df=calibration_hourly_df,
     )
 
+
+def write_calibrated_data(
+    mit_experiment_name="final-city-scanner-data",
+    dcmr_experiment_name="schiedam-december-2022",
+    output_name="final-data",
+    calibration_sensor_names=["ams3", "ams4"],
+    experiment_sensor_names=["ams1", "ams2", "ams3", "ams4"],
+    calibration_start_datetime=CALIBRATION_START_DATETIME,
+    calibration_end_datetime=CALIBRATION_END_DATETIME,
+    experiment_start_datetime=EXPERIMENT_START_DATE,
+    experiment_end_datetime=EXPERIMENT_END_DATE,
+    calibration_knmi_station_code="344",
+    experiment_knmi_station_code="240",
+    plot_calibration_training_results=True,
+    persist_background=True,
+    reuse_calibrator=True,
+    sensor_name2corrections=MIT_SENSOR_NAME2CORRECTIONS,
+):
+    """
+    :param persist_background: also store the calibrated levels without
+        background, so they aren't recomputed whenever the data is loaded.
+    :param reuse_calibrator: use the calibrator which was stored by an earlier
+        run with the same calibration data and hyperparameters, instead of
+        training it again. the trained calibrator is always stored.
+    :param sensor_name2corrections: corrections of the raw data of specific
+        experiment sensors, see apply_sensor_corrections.
+    """
+    calibrator = MITDCMRCalibrator(
+        plot_results=plot_calibration_training_results
+    )
+
+    # the calibrator is stored per version of the calibration data
+    mit_data_loader = MITDataLoader()
+    artifact_fpath = get_artifact_fpath(
+        [
+            fpath
+            for sensor_name in calibration_sensor_names
+            for fpath in mit_data_loader.get_fpaths(
+                mit_experiment_name, sensor_name
+            )
+        ]
+        + [KNMIDataLoader().get_fpath(calibration_knmi_station_code)]
+        + DCMRDataLoader().get_fpaths(dcmr_experiment_name),
+        calibration_sensor_names=calibration_sensor_names,
+        calibration_start_datetime=calibration_start_datetime,
+        calibration_end_datetime=calibration_end_datetime,
+        **calibrator.get_params(),
+    )
+    if reuse_calibrator and artifact_fpath.exists():
+        print(f"loading the calibrator from {artifact_fpath}")
+        calibrator = MITDCMRCalibrator.load(
+            artifact_fpath, plot_results=plot_calibration_training_results
+        )
+    else:
+        train_calibrator(
+            calibrator,
+            mit_experiment_name,
+            dcmr_experiment_name,
+            calibration_sensor_names,
+            calibration_start_datetime,
+            calibration_end_datetime,
+            calibration_knmi_station_code,
+        )
+        calibrator.save(artifact_fpath)
+
     experiment_knmi_df = KNMIDataLoader().load_data(
         experiment_knmi_station_code,
         start_date=experiment_start_datetime,
         end_date=experiment_end_datetime,
     )
-    sensor_name210sec_df = {}
-    sensor_name2hourly_df = {}
-    for sensor_name in experiment_sensor_names:
-        experiment_mit_df = MITDataLoader().load_data(
-            mit_experiment_name, [sensor_name]
-        )
-
-        if sensor_name == "ams1":
-            experiment_mit_df["PM25"] -= 8.18
-            experiment_mit_df.loc[experiment_mit_df["PM25"] < 0, "PM25"] = 0
-
-        experiment_data_preprocessor = InputDataPreprocessor(
-            experiment_mit_df,
-            experiment_knmi_df,
-            start_datetime=experiment_start_datetime,
-            end_datetime=experiment_end_datetime,
-        )
-        experiment_10sec_df = experiment_data_preprocessor.get_10sec_data()
-        experiment_hourly_df = experiment_data_preprocessor.get_hourly_data()
-
-        experiment_10sec_df, experiment_hourly_df = calibrator.calibrate(
-            experiment_10sec_df, experiment_hourly_df
-        )
-        sensor_name210sec_df[sensor_name] = experiment_10sec_df
-        sensor_name2hourly_df[sensor_name] = experiment_hourly_df
+    # all sensors are preprocessed and calibrated at once, stacked in a
+    # single frame
+    experiment_mit_df = MITDataLoader().load_data(
+        mit_experiment_name,
+        experiment_sensor_names,
+        columns=MIT_COLUMNS,
+        start=experiment_start_datetime,
+        end=experiment_end_datetime,
+    )
+    experiment_data_preprocessor = InputDataPreprocessor(
+        experiment_mit_df,
+        experiment_knmi_df,
+        start_datetime=experiment_start_datetime,
+        end_datetime=experiment_end_datetime,
+        sensor_name2corrections=sensor_name2corrections,
+    )
+    experiment_10sec_df = (
+        experiment_data_preprocessor.get_10sec_data_per_sensor()
+    )
+    experiment_hourly_df = (
+        experiment_data_preprocessor.get_hourly_data_per_sensor()
+    )
+    experiment_10sec_df, experiment_hourly_df = calibrator.calibrate(
+        experiment_10sec_df, experiment_hourly_df
+    )
 
     cdl = CalibratedDataLoader(output_name)
-    cdl.write_data("10sec", pd.concat(sensor_name210sec_df))
-    cdl.write_data("hourly", pd.concat(sensor_name2hourly_df))
+    cdl.write_data("10sec", experiment_10sec_df)
+    cdl.write_data("hourly", experiment_hourly_df)
+    if persist_background:
+        # computed per day, so the memory use doesn't grow with the period
+        cdl.write_cols_without_bg("10sec", freq="D")
+        cdl.write_cols_without_bg("hourly", freq="D")
 
 
 if __name__ == "__main__":
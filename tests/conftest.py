@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# mcs.constants needs a ROOT_DIR. the tests point the data and cache
+# directories they use to their own temporary directories
+os.environ.setdefault("ROOT_DIR", tempfile.mkdtemp())
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+# mcs.data_loaders imports mcs.background_levels, so it has to be
+# imported first
+import mcs.data_loaders  # noqa: F401
+from mcs import background_levels
+from mcs.background_levels import (
+    DEFAULT_STATION_TYPE2WEIGHT,
+    get_background_level,
+    load_weighted_mean_background_level,
+)
+
+HOURS = pd.date_range("2022-01-01", periods=4, freq="h")
+GGD_DF = pd.DataFrame(
+    {"A": [10.0, 20.0, 30.0, 40.0], "B": [0.0, 0.0, 0.0, 0.0]}, index=HOURS
+)
+GGD_STATION_METADATA_DF = pd.DataFrame(
+    {"Stationstype": ["achtergrond", "industrie"]}, index=["A", "B"]
+)
+
+
+@pytest.fixture(autouse=True)
+def ggd_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(background_levels, "BACKGROUND_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(background_levels, "_get_ggd_fpaths", lambda: [])
+    monkeypatch.setattr(
+        background_levels,
+        "load_ggd_data",
+        lambda component: (GGD_DF, GGD_STATION_METADATA_DF),
+    )
+    background_levels._load_weighted_mean_background_level.cache_clear()
+    yield
+    background_levels._load_weighted_mean_background_level.cache_clear()
+
+
+def test_entry_points_use_the_same_default_weights():
+    # by default, all station types count equally
+    expected = GGD_DF.mean(axis=1)
+    pd.testing.assert_series_equal(
+        load_weighted_mean_background_level("NO2"), expected
+    )
+    pd.testing.assert_series_equal(
+        get_background_level(HOURS, "NO2"), expected, check_freq=False
+    )
+
+
+def test_entry_points_use_the_default_station_type2weight_for_none():
+    # industrie has a weight of 0, so only station A counts
+    expected = GGD_DF["A"].rename(None)
+    pd.testing.assert_series_equal(
+        load_weighted_mean_background_level("NO2", None), expected
+    )
+    pd.testing.assert_series_equal(
+        get_background_level(HOURS, "NO2", None), expected, check_freq=False
+    )
+    pd.testing.assert_series_equal(
+        get_background_level(HOURS, "NO2", DEFAULT_STATION_TYPE2WEIGHT),
+        expected,
+        check_freq=False,
+    )
+
+
+def test_cache_is_keyed_on_the_resolved_weights(tmp_path):
+    load_weighted_mean_background_level("NO2")
+    # the same weights, once resolved
+    load_weighted_mean_background_level("NO2", {})
+    assert len(list(tmp_path.glob("weighted_mean_*.parquet"))) == 1
+
+    background_levels._load_weighted_mean_background_level.cache_clear()
+    assert not np.allclose(
+        load_weighted_mean_background_level("NO2", None),
+        load_weighted_mean_background_level("NO2"),
+    )
+    assert len(list(tmp_path.glob("weighted_mean_*.parquet"))) == 2
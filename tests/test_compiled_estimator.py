@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mcs.estimators import RegressionEstimator
+from mcs.log_encoder import LogEncoder
+from mcs.models import (
+    get_linear_regression_model,
+    get_polynomial_regression_model,
+)
+
+X_COLS = ["mit_pm25", "mit_humidity", "knmi_temperature"]
+
+
+@pytest.fixture
+def df():
+    rng = np.random.default_rng(0)
+    n = 1000
+    df = pd.DataFrame(
+        {
+            "mit_pm25": rng.uniform(1, 50, n),
+            "mit_humidity": rng.uniform(20, 90, n).astype("float32"),
+            "knmi_temperature": rng.uniform(1, 20, n),
+        }
+    )
+    df["dcmr_PM25"] = (
+        0.8 * df.mit_pm25 + 0.1 * df.mit_humidity + rng.uniform(1, 2, n)
+    )
+    return df
+
+
+@pytest.mark.parametrize(
+    "x_cols_to_encode",
+    [[], ["mit_pm25"], [0], [-1], [0, -1], np.array([1])],
+)
+@pytest.mark.parametrize(
+    "get_model",
+    [
+        get_linear_regression_model,
+        lambda: get_polynomial_regression_model(degree=2),
+    ],
+)
+def test_compiled_predictions_equal_those_of_the_estimator(
+    df, x_cols_to_encode, get_model
+):
+    estimator = RegressionEstimator(
+        get_model(),
+        df,
+        X_COLS,
+        "dcmr_PM25",
+        do_cross_validation=False,
+        encoder=LogEncoder(x_cols_to_encode),
+    )
+    estimator.train()
+
+    y_pred = estimator.predict(df)
+    compiled_y_pred = estimator.compile().predict(df)
+    assert compiled_y_pred.dtype == y_pred.dtype
+    np.testing.assert_allclose(compiled_y_pred, y_pred, rtol=1e-5)
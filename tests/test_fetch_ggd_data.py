@@ -0,0 +1,97 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the scripts aren't a package
+sys.path.insert(0, str(Path(__file__).parents[1] / "scripts"))
+import fetch_ggd_data  # noqa: E402
+
+URL = f"{fetch_ggd_data.GGD_LUCHTMEETNET_COMPLETED_YEAR_BASE_URL}2021/"
+
+
+class FakeResponse(object):
+    def __init__(self, headers):
+        self.status_code = 200
+        self.headers = headers
+
+
+class FakeSession(object):
+    def __init__(self, headers):
+        self.headers = headers
+        self.head_urls = []
+
+    def head(self, url, allow_redirects=False):
+        self.head_urls.append(url)
+        return FakeResponse(self.headers)
+
+
+@pytest.fixture
+def ggd_data_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch_ggd_data, "GGD_DATA_DIR", tmp_path)
+    monkeypatch.setattr(
+        fetch_ggd_data,
+        "GGD_SYNC_MANIFEST_FPATH",
+        tmp_path / "sync_manifest.json",
+    )
+    return tmp_path
+
+
+def write_file(ggd_data_dir, year, component):
+    fpath = ggd_data_dir / year / f"{year}_{component}.csv"
+    fpath.parent.mkdir(exist_ok=True, parents=True)
+    fpath.write_text("")
+    return fpath
+
+
+def test_mixed_manifest(ggd_data_dir, monkeypatch):
+    # the first file was fetched by fetch_ggd_data, the second one by
+    # sync_ggd_data, which only records whether it's provisional
+    fetched_fpath = write_file(ggd_data_dir, "2021", "NO2")
+    synced_fpath = write_file(ggd_data_dir, "2021", "NOx")
+    fetch_ggd_data.update_sync_manifest(
+        fetched_fpath,
+        url=URL + fetched_fpath.name,
+        etag='"abc"',
+        content_length="10",
+        provisional=True,
+    )
+    fetch_ggd_data.update_sync_manifest(synced_fpath, provisional=True)
+    manifest = fetch_ggd_data.read_sync_manifest()
+
+    session = FakeSession({"ETag": '"abc"', "Content-Length": "10"})
+    assert fetch_ggd_data.is_unchanged_on_server(
+        session, URL, URL + fetched_fpath.name, fetched_fpath, manifest
+    )
+    assert not fetch_ggd_data.is_unchanged_on_server(
+        session, URL, URL + synced_fpath.name, synced_fpath, manifest
+    )
+    # the synced file isn't ours, so the server isn't asked about it
+    assert session.head_urls == [URL]
+
+    monkeypatch.setattr(
+        fetch_ggd_data, "create_session", lambda n_workers: session
+    )
+    downloads = fetch_ggd_data.get_ggd_downloads(
+        years=["2021"], only_missing=True
+    )
+    fpaths = {download.fpath for download in downloads}
+    assert fetched_fpath not in fpaths
+    assert synced_fpath in fpaths
+
+
+def test_changed_on_server(ggd_data_dir):
+    fpath = write_file(ggd_data_dir, "2021", "NO2")
+    url = URL + fpath.name
+    fetch_ggd_data.update_sync_manifest(
+        fpath, url=url, etag=None, content_length="10", provisional=True
+    )
+    manifest = fetch_ggd_data.read_sync_manifest()
+
+    # without an ETag, the Content-Length is compared
+    assert fetch_ggd_data.is_unchanged_on_server(
+        FakeSession({"Content-Length": "10"}), url, url, fpath, manifest
+    )
+    assert not fetch_ggd_data.is_unchanged_on_server(
+        FakeSession({"Content-Length": "11"}), url, url, fpath, manifest
+    )
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mcs.constants import MIT_CSV_HEADERS
+from mcs.data_loaders import mit
+from mcs.data_loaders.mit import MITDataLoader
+
+# the preprocessing only keeps the data of this year
+YEAR = datetime.now().year
+DAYS = [f"{YEAR}-01-0{day}" for day in [2, 3, 4]]
+
+
+def write_csv(fpath, day, n_rows=100):
+    df = pd.DataFrame({col: np.full(n_rows, 1.0) for col in MIT_CSV_HEADERS})
+    df["is_summary"] = 0
+    df["deviceID"] = "s1"
+    df["timestamp"] = pd.Timestamp(f"{day} 06:00").value // 10**9 + (
+        np.arange(n_rows) * 10
+    )
+    df["latitude"] = 52.3
+    df["longitude"] = 4.9
+    df["data_is_valid"] = 1
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(fpath, header=False, index=False)
+
+
+@pytest.fixture
+def parsed_fpaths(tmp_path, monkeypatch):
+    """write a csv per day, and record which csvs are parsed."""
+    monkeypatch.setattr(mit, "MIT_DATA_DIR", tmp_path / "data")
+    monkeypatch.setattr(mit, "MIT_CACHE_DIR", tmp_path / "cache")
+    for i, day in enumerate(DAYS):
+        write_csv(tmp_path / "data" / "exp" / "s1" / f"F{i}.CSV", day)
+
+    parsed_fpaths = []
+    read_csv = MITDataLoader._read_csv
+
+    def recording_read_csv(self, fpath, usecols=None):
+        parsed_fpaths.append(fpath.name)
+        return read_csv(self, fpath, usecols)
+
+    monkeypatch.setattr(MITDataLoader, "_read_csv", recording_read_csv)
+    return parsed_fpaths
+
+
+def test_loader_without_cache_skips_files_using_the_stored_index(
+    tmp_path, parsed_fpaths
+):
+    MITDataLoader(use_cache=True).load_data("exp", "s1")
+    assert (tmp_path / "cache" / "exp" / "s1.file_index.json").exists()
+    cache_fpath2mtime = {
+        fpath: fpath.stat().st_mtime
+        for fpath in (tmp_path / "cache").glob("**/*")
+    }
+
+    parsed_fpaths.clear()
+    df = MITDataLoader(use_cache=False).load_data(
+        "exp", ["s1"], start=DAYS[1], end=DAYS[1]
+    )
+    assert parsed_fpaths == ["F1.CSV"]
+    assert (
+        df.index.get_level_values("timestamp").normalize() == DAYS[1]
+    ).all()
+    # a loader without a cache doesn't write to the cache directory
+    assert {
+        fpath: fpath.stat().st_mtime
+        for fpath in (tmp_path / "cache").glob("**/*")
+    } == cache_fpath2mtime
+
+
+def test_loader_without_cache_skips_files_it_parsed_before(
+    tmp_path, parsed_fpaths
+):
+    data_loader = MITDataLoader(use_cache=False)
+    full_df = data_loader.load_data("exp", "s1")
+    assert sorted(parsed_fpaths) == ["F0.CSV", "F1.CSV", "F2.CSV"]
+
+    parsed_fpaths.clear()
+    df = data_loader.load_data("exp", ["s1"], start=DAYS[2], end=DAYS[2])
+    assert parsed_fpaths == ["F2.CSV"]
+    pd.testing.assert_index_equal(
+        df.loc["s1"].index, full_df.loc[DAYS[2] : DAYS[2]].index
+    )
+    assert not (tmp_path / "cache").exists()